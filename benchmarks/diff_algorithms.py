@@ -0,0 +1,111 @@
+#!/usr/bin/python3
+
+# benchmark diff.py algorithms (external `diff -u`, difflib, myers, patience, histogram)
+# on large, highly repetitive blocks (LaTeX tables, repeated macros)
+#
+# USAGE: benchmarks/diff_algorithms.py [repeats]
+
+
+# Copyright (c) 2019 Robert Ryszard Paciorek <rrp@opcode.eu.org>
+# 
+# MIT License
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import sys, os, io, random, tempfile
+from benchutil import bench
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), "..", "compare"))
+import diff
+
+algorithms = ["external", "difflib", "myers", "patience", "histogram"]
+
+
+# table with many identical rows and few unique cells
+def tableBlock(rows, rnd):
+	lines = ["\\begin{tabular}{|l|l|l|}\n", "\\hline\n"]
+	for i in range(rows):
+		if rnd.random() < 0.05:
+			lines.append("value %d & x & y \\\\\n" % rnd.randint(0, 20))
+		else:
+			lines.append("a & b & c \\\\\n")
+		lines.append("\\hline\n")
+	return lines + ["\\end{tabular}\n"]
+
+# repeated macros with small number of different arguments
+def macrosBlock(rows, rnd):
+	return ["\\item \\textbf{%s} -- \\lstinline{%s}\n" % (rnd.choice("abc"), rnd.choice("xy")) for i in range(rows)]
+
+# table without any unique line (only \hline and zero rows)
+def zerosBlock(rows):
+	return ["\\hline\n", "& 0 & 0 \\\\\n"] * rows
+
+# apply few random edits (change, insert, delete lines)
+# when newLines is given changed and inserted lines are chosen from it (so edits don't add unique lines)
+def editBlock(lines, edits, rnd, newLines=None):
+	lines = list(lines)
+	for i in range(edits):
+		k = rnd.randrange(len(lines))
+		r = rnd.random()
+		if r < 0.4:
+			lines[k] = rnd.choice(newLines) if newLines else "changed %d\n" % i
+		elif r < 0.7:
+			lines.insert(k, rnd.choice(newLines) if newLines else "inserted %d\n" % i)
+		else:
+			del lines[k]
+	return lines
+
+# compare files (in-process, without output) -- as diff.py run
+def compareFiles(pathA, pathB, algorithm):
+	diff.compareFiles(pathA, pathB, io.StringIO(), algorithm=algorithm)
+
+def printRow(name, times):
+	print("%-24s" % name + "".join("%11.3fs" % times[a] for a in algorithms) +
+	      "%10.1fx%10.1fx" % (times["external"] / times["histogram"], times["difflib"] / times["histogram"]))
+
+
+if __name__ == "__main__":
+	repeats = int(sys.argv[1]) if len(sys.argv) > 1 else 3
+	rnd = random.Random(2019)
+	
+	cases = []
+	for rows in (500, 2000, 8000):
+		blockA = tableBlock(rows, rnd)
+		cases.append(["table %d rows" % rows, blockA, editBlock(blockA, rows // 50, rnd)])
+	for rows in (1000, 4000):
+		blockA = macrosBlock(rows, rnd)
+		cases.append(["macros %d lines" % rows, blockA, editBlock(blockA, rows // 50, rnd)])
+	# no anchors for patience and histogram and many edits -- whole block compared by Myers algorithm
+	blockA = zerosBlock(3000)
+	cases.append(["zeros 6000 lines", blockA, editBlock(blockA, 800, rnd, blockA[:2])])
+	
+	print("%-24s" % "case" + "".join("%12s" % a for a in algorithms) + "%11s%11s" % ("hist/ext", "hist/dl"))
+	for name, blockA, blockB in cases:
+		printRow(name, {a: bench(repeats, diff.compareBlock, blockA, blockB, 0, 0, "bench", a) for a in algorithms})
+	
+	# whole document -- many medium size repetitive blocks
+	with tempfile.TemporaryDirectory() as tmpDir:
+		pathA, pathB = os.path.join(tmpDir, "a.txt"), os.path.join(tmpDir, "b.txt")
+		with open(pathA, "w") as fileA, open(pathB, "w") as fileB:
+			for i in range(300):
+				blockA = tableBlock(rnd.randint(50, 400), rnd)
+				blockB = editBlock(blockA, rnd.randint(0, 5), rnd)
+				fileA.writelines(["% BEGIN: table" + str(i) + "\n"] + blockA + ["% END: table" + str(i) + "\n"])
+				fileB.writelines(["% BEGIN: table" + str(i) + "\n"] + blockB + ["% END: table" + str(i) + "\n"])
+		printRow("document 300 tables", {a: bench(repeats, compareFiles, pathA, pathB, a) for a in algorithms})
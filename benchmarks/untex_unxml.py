@@ -0,0 +1,116 @@
+#!/usr/bin/python3
+
+# benchmark normalizing scripts used before diff.py (untex.py, unxml.py) on generated books
+#
+# USAGE: benchmarks/untex_unxml.py [lines [repeats]]
+
+
+# Copyright (c) 2019 Robert Ryszard Paciorek <rrp@opcode.eu.org>
+# 
+# MIT License
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import sys, os, random
+from benchutil import bench
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), "..", "compare"))
+import untex, unxml
+
+words = "lorem ipsum dolor sit amet consectetur adipiscing elit sed do eiusmod tempor".split()
+
+
+def text(rnd, n):
+	return " ".join(rnd.choice(words) for i in range(n))
+
+# inline TeX fragment: text, math, font switches, code, references, quotes
+def texInline(rnd):
+	return rnd.choice((
+		lambda: text(rnd, 3),
+		lambda: rnd.choice(("$x^2$", "$\\alpha + \\beta$", "$\\frac{a}{b}$", "$a_i$", "$\\sum_{i=0}^n i$")),
+		lambda: "\\textbf{" + text(rnd, 2) + "}",
+		lambda: "\\emph{" + text(rnd, 2) + "}",
+		lambda: "{\\it " + text(rnd, 2) + "}",
+		lambda: "\\lstinline{int x = 0;}",
+		lambda: ",," + text(rnd, 2) + "''",
+		lambda: "zob.~\\ref{sec:" + text(rnd, 1) + "}",
+		lambda: "\\cite[p.~3]{knuth}",
+	))()
+
+# LaTeX book -- list of lines
+def texBook(lines, rnd):
+	book = []
+	for i in range(lines):
+		r = rnd.random()
+		if r < 0.05:
+			l = "\\section{" + text(rnd, 3) + "}\\label{sec:" + text(rnd, 1) + "}"
+		elif r < 0.12:
+			l = rnd.choice(("\\begin{itemize}", "\\end{itemize}", "\\begin{tabular}{|l|c|}", "\\end{tabular}", "\\vspace{1em}"))
+		elif r < 0.20:
+			l = "\t\\item " + " ".join(texInline(rnd) for j in range(rnd.randint(1, 4)))
+		elif r < 0.25:
+			l = text(rnd, 2) + " & $x_" + str(i) + "$ & " + text(rnd, 1) + " \\\\"
+		elif r < 0.30:
+			l = ""
+		else:
+			l = " ".join(texInline(rnd) for j in range(rnd.randint(2, 10)))
+		book.append(l + "\n")
+	return book
+
+# inline XML fragment: text, math, images, formatting tags, entities
+def xmlInline(rnd):
+	return rnd.choice((
+		lambda: text(rnd, 3),
+		lambda: "<m>\\frac{a}{b} &lt; x</m>",
+		lambda: '<img alt="a" src="img/' + text(rnd, 1) + '.png" />',
+		lambda: "<b>" + text(rnd, 2) + "</b>",
+		lambda: '<a href="#x">' + text(rnd, 2) + "</a>",
+		lambda: "<code>a&lt;b&gt;c &amp; d</code>",
+	))()
+
+# XML book (as used by xml2xhtml.py) with BEGIN/END comments -- list of lines
+def xmlBook(lines, rnd):
+	book = ['<?xml version="1.0" encoding="utf-8"?>\n', '<article xmlns="http://www.w3.org/1999/xhtml">\n']
+	section = 0
+	while len(book) < lines:
+		section += 1
+		book.append("<!-- BEGIN: sec%d -->\n<section><title>%s</title>\n" % (section, text(rnd, 3)))
+		for i in range(rnd.randint(3, 30)):
+			r = rnd.random()
+			if r < 0.1:
+				book.append("<dl><dt>" + text(rnd, 1) + "</dt><dd>" + text(rnd, 3) + "</dd></dl>\n")
+			elif r < 0.2:
+				book.append("<ul>\n\t<li>" + xmlInline(rnd) + "</li>\n</ul>\n")
+			else:
+				book.append("<p>" + " ".join(xmlInline(rnd) for j in range(rnd.randint(1, 8))) + "</p>\n")
+		book.append("</section>\n<!-- END: sec%d -->\n" % section)
+	return book + ["</article>\n"]
+
+
+if __name__ == "__main__":
+	lines   = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+	repeats = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+	rnd = random.Random(2019)
+	
+	book = texBook(lines, rnd)
+	print("%-24s%10.3fs" % ("untex %d lines" % lines, bench(repeats, lambda: sum(1 for l in untex.untex(book)))))
+	
+	book = xmlBook(lines, rnd)
+	print("%-24s%10.3fs" % ("unxml %d lines" % lines, bench(repeats, lambda: sum(1 for l in unxml.unxml(book)))))
+	print("%-24s%10.3fs" % ("unxml (regex)", bench(repeats, lambda: sum(1 for l in unxml.unxmlRegex(book)))))
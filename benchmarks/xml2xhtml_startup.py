@@ -0,0 +1,82 @@
+#!/usr/bin/python3
+
+# benchmark cold start of xml2xhtml.py -- wall time and import time for trivial document (without <m> and <insertSourceCode>)
+#
+# USAGE: benchmarks/xml2xhtml_startup.py [repeats [maxRatio]]
+#
+# exit with status 1 when xml2xhtml.py wall time is more than maxRatio (default: 6) times
+# wall time of `python3 -c pass` (ratio, not absolute time, so limit don't depend on machine speed)
+
+
+# Copyright (c) 2019 Robert Ryszard Paciorek <rrp@opcode.eu.org>
+# 
+# MIT License
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import sys, os, tempfile, subprocess
+from benchutil import bench
+
+script = os.path.join(os.path.dirname(os.path.realpath(__file__)), "..", "convert", "xml2xhtml.py")
+
+defaultMaxRatio = 6.0
+
+document = """<?xml version="1.0" encoding="UTF-8"?>
+<html xmlns="http://www.w3.org/1999/xhtml"><head><title>Test</title></head><body>
+<ul id="toc"></ul>
+<section><h2>Section</h2><p>Some text.</p></section>
+</body></html>
+"""
+
+# return total import time (in seconds) and list of [time, module] for top level imports (from `python -X importtime`)
+def importTimes(command):
+	res = subprocess.run([sys.executable, "-X", "importtime"] + command, check=True, stderr=subprocess.PIPE, universal_newlines=True)
+	modules = []
+	for line in res.stderr.splitlines():
+		if not line.startswith("import time:") or "cumulative" in line:
+			continue
+		self, cumulative, name = line[12:].split("|")
+		if not name.startswith("  "):
+			modules.append([int(cumulative) / 1e6, name.strip()])
+	return sum(t for t, name in modules), sorted(modules, reverse=True)
+
+
+if __name__ == "__main__":
+	repeats = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+	maxRatio = float(sys.argv[2]) if len(sys.argv) > 2 else defaultMaxRatio
+	
+	with tempfile.TemporaryDirectory() as tmpDir:
+		inputPath, outputPath = os.path.join(tmpDir, "test.xml"), os.path.join(tmpDir, "test.xhtml")
+		with open(inputPath, "w") as f:
+			f.write(document)
+		command = [script, "--cache", os.path.join(tmpDir, "cache"), inputPath, outputPath]
+		
+		baseTime = bench(repeats, subprocess.run, [sys.executable, "-c", "pass"], check=True)
+		scriptTime = bench(repeats, subprocess.run, [sys.executable] + command, check=True)
+		print("%-32s%10.3fs" % ("python3 -c pass", baseTime))
+		print("%-32s%10.3fs%10.1fx" % ("xml2xhtml.py", scriptTime, scriptTime / baseTime))
+		
+		total, modules = importTimes(command)
+		print("%-32s%10.3fs" % ("imports", total))
+		for t, name in modules[:8]:
+			print("  %-30s%10.3fs" % (name, t))
+	
+	if scriptTime > maxRatio * baseTime:
+		print("FAIL: xml2xhtml.py start is %.1fx slower than `python3 -c pass` (limit: %.1fx)" % (scriptTime / baseTime, maxRatio), file=sys.stderr)
+		sys.exit(1)
@@ -24,27 +24,315 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
-import sys, os, re, tempfile
+import sys, os, re, stat, mmap, time, tempfile, argparse, difflib, subprocess, collections, hashlib, json, bisect, fnmatch
+import xml.parsers.expat
+from concurrent.futures import ProcessPoolExecutor
 
-# check args
-if len(sys.argv) != 3:
-	print("USAGE:", sys.argv[0], " fileA fileB", file=sys.stderr)
-	print("compare all BEGIN/END block from fileA to corresponding block in fileB", file=sys.stderr)
-	exit(1)
+from normalize import normalizers, normalizeFile
 
 # TODO: should be set from command line options:
 openBlockRegex = '^(.*?) BEGIN: (.*)\n'
 endBlockRepl   = '\\1 END: \\2\n'  # re.sub() replacment string used with openBlockRegex to build blockEnd line
 nameBlockRepl  = '\\2'  # re.sub() replacment string used with openBlockRegex to build blockId
+diffContext    = 3      # number of context lines in unified diff (as `diff -u`)
+chunkLines     = 4096   # (with --jobs) max number of lines in group of blocks send to single worker task
+maxPending     = 64     # (with --jobs) max number of groups waiting for results (limit memory usage)
+cacheVersion   = "diff.py:1:context=%d" % diffContext  # saved in --cache file, cache with other version is ignored
+autoMaxLines   = 200    # (with --algorithm auto) blocks with more lines are compared by histogram algorithm (other by Myers)
+histogramMaxChain = 64  # (histogram algorithm) lines with more occurrences are not used as anchors
+myersMaxCost   = 64     # (Myers algorithm) max number of edits searched for middle snake, for ranges with more differences
+                        # range is split on furthest reaching point (as `diff` does, result can be not minimal)
 
+blockRegEx = re.compile(openBlockRegex)
+
+
+# compare two lists of lines, return list of unified diff hunks
+# each hunk is [aStart, aLen, bStart, bLen, bodyLines] with line numbers relative to begin of lists
+# (numbering as in `diff -u` output: from 1, for empty range number of line before range)
+def diffLines(linesA, linesB, context=diffContext, algorithm="myers"):
+	hunks = []
+	if algorithm == "auto":
+		algorithm = "histogram" if max(len(linesA), len(linesB)) > autoMaxLines else "myers"
+	if algorithm == "difflib":
+		matcher = difflib.SequenceMatcher(None, linesA, linesB, autojunk=False)
+	else:
+		matcher = AnchoredMatcher(anchoredMatches(linesA, linesB, algorithm))
+	for group in matcher.get_grouped_opcodes(context):
+		a1, a2, b1, b2 = group[0][1], group[-1][2], group[0][3], group[-1][4]
+		body = []
+		for op, i1, i2, j1, j2 in group:
+			if op == 'equal':
+				addHunkLines(body, ' ', linesA[i1:i2])
+				continue
+			if op in ('replace', 'delete'):
+				addHunkLines(body, '-', linesA[i1:i2])
+			if op in ('replace', 'insert'):
+				addHunkLines(body, '+', linesB[j1:j2])
+		hunks.append([
+			a1 + 1 if a2 > a1 else a1, a2 - a1,
+			b1 + 1 if b2 > b1 else b1, b2 - b1,
+			body
+		])
+	return hunks
+
+def addHunkLines(body, prefix, lines):
+	for l in lines:
+		body.append(prefix + l)
+		if l[-1:] != '\n':
+			body.append('\n\\ No newline at end of file\n')
+
+
+# Myers (minimal diff) and anchor-based diff algorithms (patience and histogram)
+# results are lists of matching blocks (i, j, n) as difflib.SequenceMatcher.get_matching_blocks()
+
+# difflib.SequenceMatcher using matching blocks calculated by anchoredMatches()
+# (get_opcodes() and get_grouped_opcodes() use only get_matching_blocks())
+class AnchoredMatcher(difflib.SequenceMatcher):
+	def __init__(self, matchingBlocks):
+		self.matchingBlocks = matchingBlocks
+		self.opcodes = None
+	
+	def get_matching_blocks(self):
+		return self.matchingBlocks
+
+# compare a and b lists by "patience" or "histogram" algorithm, return matching blocks
+# parts without anchors (unique lines for patience, rare lines for histogram) are compared by Myers algorithm
+# ("myers" algorithm doesn't use anchors -- whole lists are compared by Myers algorithm)
+def anchoredMatches(a, b, algorithm):
+	findAnchors = {"patience": patienceAnchors, "histogram": histogramAnchors}.get(algorithm)
+	matches = []
+	ranges = [(0, len(a), 0, len(b))]
+	while ranges:
+		a0, a1, b0, b1 = ranges.pop()
+		
+		# common prefix and suffix
+		n = 0
+		while a0 + n < a1 and b0 + n < b1 and a[a0+n] == b[b0+n]:
+			n += 1
+		if n:
+			matches.append((a0, b0, n))
+			a0, b0 = a0 + n, b0 + n
+		n = 0
+		while a0 < a1 - n and b0 < b1 - n and a[a1-n-1] == b[b1-n-1]:
+			n += 1
+		if n:
+			matches.append((a1 - n, b1 - n, n))
+			a1, b1 = a1 - n, b1 - n
+		if a0 == a1 or b0 == b1:
+			continue
+		
+		anchors = findAnchors(a, b, a0, a1, b0, b1) if findAnchors else None
+		if not anchors:
+			matches += myersMatches(a, b, a0, a1, b0, b1)
+			continue
+		
+		# split range on anchors (matching regions), compare sub-ranges
+		for i, j, n in anchors:
+			matches.append((i, j, n))
+			ranges.append((a0, i, b0, j))
+			a0, b0 = i + n, j + n
+		ranges.append((a0, a1, b0, b1))
+	
+	# sort and join adjacent matching blocks
+	result = []
+	for i, j, n in sorted(matches):
+		if result and result[-1][0] + result[-1][2] == i and result[-1][1] + result[-1][2] == j:
+			result[-1] = (result[-1][0], result[-1][1], result[-1][2] + n)
+		else:
+			result.append((i, j, n))
+	result.append((len(a), len(b), 0))
+	return result
+
+# Myers O((N+M)D) diff in linear space for a[a0:a1] and b[b0:b1], return matching blocks (unsorted)
+# lines without any occurrence in the other part can't be matched, so (as `diff` does) only other lines are compared
+# -- result is the same, but mostly rewritten ranges (e.g. translated text) are compared much faster
+def myersMatches(a, b, a0, a1, b0, b1):
+	linesA, linesB = set(a[a0:a1]), set(b[b0:b1])
+	indexA = [i for i in range(a0, a1) if a[i] in linesB]
+	indexB = [j for j in range(b0, b1) if b[j] in linesA]
+	if len(indexA) == a1 - a0 and len(indexB) == b1 - b0:
+		return myersRangeMatches(a, b, a0, a1, b0, b1)
+	
+	# convert matches to original lines numbers (matching block is split where discarded lines were)
+	matches = []
+	for i, j, n in myersRangeMatches([a[i] for i in indexA], [b[j] for j in indexB], 0, len(indexA), 0, len(indexB)):
+		for k in range(i, i + n):
+			iA, iB = indexA[k], indexB[k - i + j]
+			if matches and matches[-1][0] + matches[-1][2] == iA and matches[-1][1] + matches[-1][2] == iB:
+				matches[-1][2] += 1
+			else:
+				matches.append([iA, iB, 1])
+	return [tuple(m) for m in matches]
+
+# Myers diff (see myersMatches()) for all lines of a[a0:a1] and b[b0:b1]
+# range is split on middle snake (see myersMiddleSnake()) and both parts are compared in the same way (without recursion)
+def myersRangeMatches(a, b, a0, a1, b0, b1):
+	matches = []
+	ranges = [(a0, a1, b0, b1)]
+	while ranges:
+		a0, a1, b0, b1 = ranges.pop()
+		
+		# common prefix and suffix
+		n = 0
+		while a0 + n < a1 and b0 + n < b1 and a[a0+n] == b[b0+n]:
+			n += 1
+		if n:
+			matches.append((a0, b0, n))
+			a0, b0 = a0 + n, b0 + n
+		n = 0
+		while a0 < a1 - n and b0 < b1 - n and a[a1-n-1] == b[b1-n-1]:
+			n += 1
+		if n:
+			matches.append((a1 - n, b1 - n, n))
+			a1, b1 = a1 - n, b1 - n
+		if a0 == a1 or b0 == b1:
+			continue
+		
+		# (after removing common prefix and suffix there are at least 2 edits, so both parts are smaller than range)
+		x0, y0, x1, y1 = myersMiddleSnake(a, b, a0, a1, b0, b1)
+		if x1 > x0:
+			matches.append((x0, y0, x1 - x0))
+		ranges.append((a0, x0, b0, y0))
+		ranges.append((x1, a1, y1, b1))
+	return matches
+
+# find middle snake of shortest edit script for a[a0:a1] and b[b0:b1] (Myers 1986, section 4b),
+# return its start and end points (x0, y0, x1, y1) -- a[x0:x1] == b[y0:y1] is part of optimal alignment
+# forward and backward D-paths are extended alternately until they overlap, vf / vb are furthest x for diagonals
+# (backward in reversed coordinates -- distance from end of ranges), diagonal k is at index k + offset
+# when paths don't overlap after myersMaxCost edits, return (empty) snake at end of furthest reaching forward path
+# -- so time of comparing range is limited to O((N+M) * myersMaxCost)
+def myersMiddleSnake(a, b, a0, a1, b0, b1):
+	n, m = a1 - a0, b1 - b0
+	delta = n - m
+	odd = delta % 2 != 0
+	maxD = (n + m + 1) // 2
+	offset = maxD + 1
+	if maxD > myersMaxCost:
+		maxD = myersMaxCost
+	vf, vb = [0] * (2 * offset + 1), [0] * (2 * offset + 1)
+	for d in range(maxD + 1):
+		for k in range(-d, d + 1, 2):
+			if k == -d or (k != d and vf[offset+k-1] < vf[offset+k+1]):
+				x = vf[offset+k+1]
+			else:
+				x = vf[offset+k-1] + 1
+			y = x - k
+			xs, ys = x, y
+			while x < n and y < m and a[a0+x] == b[b0+y]:
+				x, y = x + 1, y + 1
+			vf[offset+k] = x
+			if odd and -(d - 1) <= delta - k <= d - 1 and x + vb[offset+delta-k] >= n:
+				return a0 + xs, b0 + ys, a0 + x, b0 + y
+		for k in range(-d, d + 1, 2):
+			if k == -d or (k != d and vb[offset+k-1] < vb[offset+k+1]):
+				x = vb[offset+k+1]
+			else:
+				x = vb[offset+k-1] + 1
+			y = x - k
+			xs, ys = x, y
+			while x < n and y < m and a[a1-x-1] == b[b1-y-1]:
+				x, y = x + 1, y + 1
+			vb[offset+k] = x
+			if not odd and -d <= delta - k <= d and x + vf[offset+delta-k] >= n:
+				return a1 - x, b1 - y, a1 - xs, b1 - ys
+	
+	# too expensive -- use point (inside range) of forward paths furthest from range start
+	x, y = max(
+		((vf[offset+k], vf[offset+k] - k) for k in range(-maxD, maxD + 1, 2) if vf[offset+k] <= n and 0 <= vf[offset+k] - k <= m),
+		key=sum, default=(n // 2, m // 2)
+	)
+	return a0 + x, b0 + y, a0 + x, b0 + y
+
+# patience diff anchors: lines unique in both ranges, longest increasing subsequence of their positions
+def patienceAnchors(a, b, a0, a1, b0, b1):
+	countA, countB, posB = collections.Counter(a[a0:a1]), collections.Counter(b[b0:b1]), {}
+	for j in range(b0, b1):
+		if countB[b[j]] == 1:
+			posB[b[j]] = j
+	unique = [(i, posB[a[i]]) for i in range(a0, a1) if countA[a[i]] == 1 and a[i] in posB]
+	
+	# patience sorting -- tops[k] is index in unique of smallest j ending increasing subsequence of length k+1
+	tops, topsJ, prev = [], [], [None] * len(unique)
+	for k, (i, j) in enumerate(unique):
+		pos = bisect.bisect_left(topsJ, j)
+		prev[k] = tops[pos-1] if pos else None
+		if pos == len(tops):
+			tops.append(k)
+			topsJ.append(j)
+		else:
+			tops[pos], topsJ[pos] = k, j
+	anchors, k = [], tops[-1] if tops else None
+	while k is not None:
+		anchors.append((unique[k][0], unique[k][1], 1))
+		k = prev[k]
+	return anchors[::-1]
 
-# prepare date for diff, and execute diff command
-def doSync(linesA, linesB, syncStart, syncStop, bOffset, tag):
+# histogram diff anchor: longest common region containing the line with lowest number of occurrences in a range
+# (as git histogram diff, return single anchor or empty list)
+def histogramAnchors(a, b, a0, a1, b0, b1):
+	positions = {}
+	for i in range(a0, a1):
+		positions.setdefault(a[i], []).append(i)
+	best, bestCount = None, histogramMaxChain + 1
+	j = b0
+	while j < b1:
+		nextJ = j + 1
+		posA = positions.get(b[j])
+		if posA and len(posA) <= min(bestCount, histogramMaxChain):
+			for i in posA:
+				# extend region around (i, j)
+				si, sj = i, j
+				while si > a0 and sj > b0 and a[si-1] == b[sj-1]:
+					si, sj = si - 1, sj - 1
+				ei, ej = i + 1, j + 1
+				while ei < a1 and ej < b1 and a[ei] == b[ej]:
+					ei, ej = ei + 1, ej + 1
+				count = min(len(positions[a[k]]) for k in range(si, ei))
+				if count < bestCount or (count == bestCount and ei - si > best[2]):
+					best, bestCount = (si, sj, ei - si), count
+				nextJ = max(nextJ, ej)
+		j = nextJ
+	return [best] if best else []
+
+# return unified diff hunks as text, with line numbers shifted by aOffset / bOffset and block tag in hunks headers
+# when lineMaps ([lineMapA, lineMapB], see mapRange()) is given line numbers in hunks headers are converted to source files line numbers
+def formatHunks(hunks, aOffset, bOffset, tag, lineMaps=None):
+	out = []
+	for aStart, aLen, bStart, bLen, body in hunks:
+		aStart, bStart = aStart + aOffset, bStart + bOffset
+		if lineMaps:
+			aStart, aLen = mapRange(lineMaps[0], aStart, aLen)
+			bStart, bLen = mapRange(lineMaps[1], bStart, bLen)
+		out.append("@@ -%d,%d +%d,%d @@ %s\n" % (aStart, aLen, bStart, bLen, tag))
+		out += body
+	return ''.join(out)
+
+# convert hunk range (start, length -- numbering as in diffLines()) in normalized file to range in source file
+# lineMap is list of source line numbers for all normalized lines (see normalize.normalizeFile()),
+# returned range covers all source lines of normalized lines in range (including removed lines between them)
+def mapRange(lineMap, start, length):
+	if length == 0:
+		return (lineMap[start - 1] if start > 0 else 0), 0
+	return lineMap[start - 1], lineMap[start + length - 2] - lineMap[start - 1] + 1
+
+# compare single block, return list of hunks (as diffLines())
+# or (for "external" algorithm) unified diff hunks text with fixed line numbers
+# blockA and blockB are lists of lines or bytes-like objects (in --mmap mode)
+def compareBlock(blockA, blockB, aOffset, bOffset, tag, algorithm="myers"):
+	if not isinstance(blockA, list):
+		# (mmap-ed file can have "\r\n" new lines)
+		blockA = splitLines(str(blockA, 'utf-8').replace('\r\n', '\n'))
+		blockB = splitLines(str(blockB, 'utf-8').replace('\r\n', '\n'))
+	
+	if algorithm != "external":
+		return diffLines(blockA, blockB, algorithm=algorithm)
+	
 	tmpA = tempfile.NamedTemporaryFile(mode="w", dir="/dev/shm")
-	tmpA.file.write(''.join( linesA[syncStart:syncStop+1] ))
+	tmpA.file.write(''.join(blockA))
 	tmpA.file.close()
 	tmpB = tempfile.NamedTemporaryFile(mode="w", dir="/dev/shm")
-	tmpB.file.write(''.join(linesB))
+	tmpB.file.write(''.join(blockB))
 	tmpB.file.close()
 	
 	# diff command
@@ -54,7 +342,7 @@ def doSync(linesA, linesB, syncStart, syncStop, bOffset, tag):
 		NR==3 {
 			printf( \
 				"@@ -%d,%d +%d,%d @@ """ + tag + """\\n", \
-				$2+""" + str(syncStart) + """, $3, \
+				$2+""" + str(aOffset) + """, $3, \
 				$4+""" + str(bOffset) + """, $5 \
 			)
 		}
@@ -63,59 +351,607 @@ def doSync(linesA, linesB, syncStart, syncStop, bOffset, tag):
 		}
 	'"""
 	# exec diff command
-	os.system(cmd)
+	return subprocess.run(cmd, shell=True, stdout=subprocess.PIPE, universal_newlines=True).stdout
 
-# read file from start tag to end tag
-def readFromTo(src, start, end, dst):
-	inBlock = False
-	blockStartLine = 0
+# compare single block (as compareBlock()), return [result, compare time in seconds]
+# result is UnicodeDecodeError object when (bytes-like) block is not valid UTF-8
+def timedCompareBlock(blockA, blockB, aOffset, bOffset, tag, algorithm="myers"):
+	startTime = time.perf_counter()
+	try:
+		result = compareBlock(blockA, blockB, aOffset, bOffset, tag, algorithm)
+	except UnicodeDecodeError as e:
+		result = e
+	return [result, time.perf_counter() - startTime]
+
+# compare group of blocks (single worker task), tasks are [blockA, blockB, aOffset, bOffset, tag],
+# return list of timedCompareBlock() results
+def compareChunk(tasks, algorithm="myers"):
+	return [timedCompareBlock(*t, algorithm=algorithm) for t in tasks]
+
+# compare blocks from tasks iterator, yield tasks (with filled result) in input order
+# task is list [blockA, blockB, aOffset, bOffset, tag, result, cacheKey, record], tasks with result != None are not compared
+# when record (dict for --report) is not None compare time is saved in record['diffTime']
+# when pool (concurrent.futures executor) is given tasks are grouped in chunks and run on workers
+def runTasks(tasks, pool=None, algorithm="myers"):
+	def setResult(t, result):
+		t[5] = result[0]
+		if t[7] is not None:
+			t[7]['diffTime'] = result[1]
+	
+	if not pool:
+		for t in tasks:
+			if t[5] is None:
+				setResult(t, timedCompareBlock(*t[:5], algorithm=algorithm))
+			yield t
+		return
+	
+	# only tasks without result are send to worker
+	def submit(chunk):
+		return pool.submit(compareChunk, [t[:5] for t in chunk if t[5] is None], algorithm)
+	
+	def getResults(chunk, future):
+		if future:
+			for t, result in zip([t for t in chunk if t[5] is None], future.result()):
+				setResult(t, result)
+		return chunk
+	
+	pending, chunk, chunkSize = collections.deque(), [], 0
+	for t in tasks:
+		if t[5] is None:
+			if isinstance(t[0], memoryview):
+				t[0], t[1] = t[0].tobytes(), t[1].tobytes()
+			chunkSize += len(t[0]) + len(t[1]) if isinstance(t[0], list) else (t[0].count(b'\n') + t[1].count(b'\n'))
+		chunk.append(t)
+		if chunkSize >= chunkLines:
+			pending.append([chunk, submit(chunk)])
+			chunk, chunkSize = [], 0
+		while len(pending) >= maxPending:
+			yield from getResults(*pending.popleft())
+	if chunk:
+		pending.append([chunk, submit(chunk) if chunkSize else None])
+	while pending:
+		yield from getResults(*pending.popleft())
+
+# fingerprint of block content (lines list or bytes-like object)
+def blockHash(block):
+	if isinstance(block, list):
+		block = ''.join(block).encode()
+	return hashlib.blake2b(block, digest_size=16).hexdigest()
+
+# load --cache file, return dict: "algorithm:hashA:hashB" -> hunks (as diffLines() result)
+# return empty dict when file not exists or has other cacheVersion
+def loadCache(path):
+	try:
+		with open(path, "r") as f:
+			data = json.load(f)
+	except (OSError, ValueError):
+		return {}
+	if data.get('version') != cacheVersion:
+		return {}
+	return data['blocks']
+
+# save --cache file (atomic, via rename)
+def saveCache(path, blocks):
+	with open(path + ".tmp", "w") as f:
+		json.dump({'version': cacheVersion, 'blocks': blocks}, f)
+	os.replace(path + ".tmp", path)
+
+# split text to list of lines (with new line chars), split only on '\n' (as readline())
+def splitLines(txt):
+	lines = txt.split('\n')
+	last = lines.pop()
+	lines = [l + '\n' for l in lines]
+	if last:
+		lines.append(last)
+	return lines
+
+
+# decode line read from file opened in binary mode (both files are decoded in the same way,
+# as by text mode readline(): UTF-8 and "\r\n" new line converted to "\n")
+def decodeLine(ll):
+	l = ll.decode()
+	if l[-2:] == '\r\n':
+		l = l[:-2] + '\n'
+	return l
+
+# read fileA (opened in binary mode) line by line and yield [blockId, startLine, blockLines] for all BEGIN/END blocks
+# on nested blocks only innermost one is compared
+def readBlocksA(src):
+	lines = []
+	syncStart, syncStop = 0, 0
+	blockId, blockEnd = None, None
 	while True:
-		ll = src.readline()
-		if ll == start:
-			inBlock = True
-		if inBlock:
-			dst.append(ll)
+		lA = decodeLine(src.readline())
+		
+		# check EOF
+		if not lA:
+			break
+		
+		# check begin / end points
+		if blockRegEx.match(lA):
+			blockEnd  = blockRegEx.sub(endBlockRepl, lA)
+			blockId   = blockRegEx.sub(nameBlockRepl, lA)
+			syncStart = len(lines)
+		if lA == blockEnd:
+			syncStop  = len(lines)
+		
+		# append lines from A file
+		lines.append(lA)
+		
+		if syncStop:
+			yield blockId, syncStart, lines[syncStart:syncStop+1]
+			syncStop = False
+
+# scan file (opened in binary mode) once and build index of all BEGIN/END blocks
+# return dict: blockId -> [startLine, endLine, startByte, endByte] (lines from 0, endByte points after END line),
+# list of duplicated blockIds (for them index contain first occurrence) and number of lines in file
+def indexBlocks(src):
+	blocks, duplicated, openBlocks = {}, [], {}
+	lineNo, offset = 0, 0
+	for ll in src:
+		l = decodeLine(ll)
+		if blockRegEx.match(l):
+			blockEnd = blockRegEx.sub(endBlockRepl, l)
+			blockId  = blockRegEx.sub(nameBlockRepl, l)
+			if blockEnd in openBlocks or blockId in blocks:
+				duplicated.append(blockId)
+			else:
+				openBlocks[blockEnd] = [blockId, lineNo, offset]
+		elif l in openBlocks:
+			blockId, startLine, startByte = openBlocks.pop(l)
+			blocks[blockId] = [startLine, lineNo, startByte, offset + len(ll)]
+		lineNo += 1
+		offset += len(ll)
+	# block without END line -- continue to end of file
+	for blockId, startLine, startByte in openBlocks.values():
+		blocks[blockId] = [startLine, lineNo - 1, startByte, offset]
+	return blocks, duplicated, lineNo
+
+# read lines of block from file indexed by indexBlocks()
+def readBlock(src, blockInfo):
+	src.seek(blockInfo[2])
+	return [decodeLine(src.readline()) for i in range(blockInfo[1] - blockInfo[0] + 1)]
+
+
+# --mmap mode functions -- files are not read into memory, only index of blocks is build
+
+# mmap file (read only), for empty file return empty bytes (can't mmap zero length file)
+# pipe, FIFO or other not regular file (e.g. `diff.py --mmap a <(cat b)`) can't be mmap-ed -- it is read into memory
+# (with "\r\n" new lines converted to "\n", as in not mmap mode)
+def mapFile(path):
+	with open(path, "rb") as f:
+		st = os.fstat(f.fileno())
+		if not stat.S_ISREG(st.st_mode):
+			return f.read().replace(b'\r\n', b'\n')
+		if st.st_size == 0:
+			return b''
+		return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+# count new line chars in mmap-ed file between start and end offsets (by chunks, without copying whole range)
+def countNewLines(buf, start, end, chunkSize=1<<20):
+	n = 0
+	for i in range(start, end, chunkSize):
+		n += buf[i:min(end, i+chunkSize)].count(b'\n')
+	return n
+
+# find all BEGIN/END blocks in mmap-ed file, yield [blockId, startLine, endLine, startByte, endByte] in BEGIN lines order
+# with innermostOnly=True skip blocks containing BEGIN line of other block and blocks without END (as readBlocksA())
+# (for file with "\r\n" new lines "\r" is removed from blockId, but END line is searched with it)
+def scanBlocks(buf, innermostOnly=False):
+	begins = re.compile(openBlockRegex.encode(), re.MULTILINE).finditer(buf)
+	m = next(begins, None)
+	lineNo, lineOffset = 0, 0
+	while m:
+		nextM = next(begins, None)
+		startByte = m.start()
+		endByte = buf.find(b'\n' + m.expand(endBlockRepl.encode()), m.end() - 1)
+		if endByte >= 0:
+			endByte = buf.find(b'\n', endByte + 1) + 1
+		elif innermostOnly:
+			m = nextM
+			continue
 		else:
-			blockStartLine += 1
-		if not ll or ll == end:
-			return blockStartLine
+			endByte = len(buf)
+		if innermostOnly and nextM and nextM.start() < endByte:
+			m = nextM
+			continue
+		
+		lineNo += countNewLines(buf, lineOffset, startByte)
+		lineOffset = startByte
+		endLine = lineNo + countNewLines(buf, startByte, endByte - 1)
+		blockId = m.expand(nameBlockRepl.encode()).decode()
+		yield [blockId[:-1] if blockId[-1:] == '\r' else blockId, lineNo, endLine, startByte, endByte]
+		m = nextM
 
+# build index of blocks for mmap-ed file -- results as indexBlocks()
+def indexBlocksBuffer(buf):
+	blocks, duplicated = {}, []
+	for blockId, startLine, endLine, startByte, endByte in scanBlocks(buf):
+		if blockId in blocks:
+			duplicated.append(blockId)
+		else:
+			blocks[blockId] = [startLine, endLine, startByte, endByte]
+	linesCount = countNewLines(buf, 0, len(buf)) + (1 if buf[-1:] not in (b'', b'\n') else 0)
+	return blocks, duplicated, linesCount
 
-# init - open files, set variables, etc
-fileA, fileB =open(sys.argv[1], "r"), open(sys.argv[2], "r")
-linesA, linesB = [], []
-syncStart, syncStop = 0, 0
-blockId, blockEnd = None, None
-blockRegEx = re.compile(openBlockRegex)
 
-# print diff header (info abiut compared files)
-print("--- " + sys.argv[1])
-print("+++ " + sys.argv[2])
-sys.stdout.flush()
-
-# main loop -- read first file
-while True:
-	lA = fileA.readline()
-	
-	# check EOF
-	if not lA:
-		break
-	
-	# check begin / end points
-	if blockRegEx.match(lA):
-		blockEnd  = blockRegEx.sub(endBlockRepl, lA)
-		blockId   = blockRegEx.sub(nameBlockRepl, lA)
-		syncStart = len(linesA)
-	if lA == blockEnd:
-		syncStop  = len(linesA)
-	
-	# append lines from A file
-	linesA.append(lA)
-	
-	# search lines from B file
-	if syncStop:
-		fileB.seek(0)
-		linesB.clear()
-		bOffset = readFromTo(fileB, linesA[syncStart], linesA[syncStop], linesB)
-		doSync(linesA, linesB, syncStart, syncStop, bOffset, blockId)
-		syncStop = False
+# compare all blocks from fileA with corresponding blocks from fileB, write unified diff to out
+# when cache dict (see loadCache()) is given: skip blocks with the same hash in A and B,
+# get hunks for already compared pairs from cache and add new results to it
+# return stats dict (see blockTasks()) with lists of blocks missing in B, duplicated in B, existing only in B and used cache keys
+# when normalize is True .tex / .xml / .xhtml / .html files are normalized (by normalize.py) before comparing
+# and line numbers in hunks headers and report are line numbers in source files
+def compareFiles(pathA, pathB, out, pool=None, useMmap=False, algorithm="myers", cache=None, report=False, normalize=False):
+	return compareMany([(pathA, pathB)], out, pool, useMmap, algorithm, cache, report, normalize)[0]
+
+# as compareFiles(), but for files content in buffers (bytes, mmap, ...)
+# nameA and nameB are used only in diff header, indexB can be result of indexBlocksBuffer(bufB) from previous call
+# lineMaps is [lineMapA, lineMapB] for buffers with normalized files (see mapRange())
+def compareBuffers(bufA, bufB, nameA, nameB, out, pool=None, algorithm="myers", cache=None, indexB=None, lineMaps=None):
+	stats = {}
+	tasks = bufferTasks(bufA, bufB, nameA, nameB, algorithm, cache, stats, indexB, lineMaps=lineMaps)
+	writeResults(runTasks(tasks, pool, algorithm), out, algorithm, cache)
+	return stats
+
+# compare many pairs of files (list of [pathA, pathB]) in single run, write combined unified diff to out
+# blocks from all files go to one tasks stream, so pool workers don't wait on files boundaries
+# return list of stats dicts (see blockTasks()) for all pairs
+# read / decode / parse errors don't stop comparing other pairs -- error message is saved in stats['failed']
+# (diff for failed pair can be incomplete)
+def compareMany(pairs, out, pool=None, useMmap=False, algorithm="myers", cache=None, report=False, normalize=False):
+	allStats = []
+	def getTasks():
+		for pathA, pathB in pairs:
+			stats = {
+				'pathA': pathA, 'pathB': pathB, 'blocks': 0, 'changed': 0, 'added': 0, 'removed': 0,
+				'missing': [], 'duplicated': [], 'onlyInB': [], 'cacheKeys': [], 'lineMaps': None,
+				'indexTime': 0.0, 'records': [], 'failed': None,
+			}
+			allStats.append(stats)
+			try:
+				yield from fileTasks(pathA, pathB, useMmap, algorithm, cache, stats, report, normalize)
+			except (OSError, ValueError, xml.parsers.expat.ExpatError) as e:
+				stats['failed'] = "can't compare " + pathA + " with " + pathB + ": " + str(e)
+	writeResults(runTasks(getTasks(), pool, algorithm), out, algorithm, cache)
+	return allStats
+
+# yield tasks (see blockTasks()) for pair of files, files are opened only for tasks generation time
+# with normalize=True files with extensions supported by normalize.py are normalized in memory (other are compared as is)
+def fileTasks(pathA, pathB, useMmap, algorithm, cache, stats, report=False, normalize=False):
+	if normalize and all(os.path.splitext(p)[1] in normalizers for p in (pathA, pathB)):
+		bufA, lineMapA = normalizeFile(pathA)
+		bufB, lineMapB = normalizeFile(pathB)
+		yield from bufferTasks(bufA, bufB, pathA, pathB, algorithm, cache, stats, report=report, lineMaps=[lineMapA, lineMapB])
+		return
+	if useMmap:
+		yield from bufferTasks(mapFile(pathA), mapFile(pathB), pathA, pathB, algorithm, cache, stats, report=report)
+		return
+	with open(pathA, "rb") as fileA, open(pathB, "rb") as fileB:
+		if not fileB.seekable():
+			# pipe (e.g. `diff.py <(untex.py a.tex) <(unxml.py b.xml)`) -- blocks can't be read by offset from index
+			bufA, bufB = fileA.read().replace(b'\r\n', b'\n'), fileB.read().replace(b'\r\n', b'\n')
+			yield from bufferTasks(bufA, bufB, pathA, pathB, algorithm, cache, stats, report=report)
+			return
+		startTime = time.perf_counter()
+		indexB = indexBlocks(fileB)
+		indexTime = time.perf_counter() - startTime
+		yield from blockTasks(
+			readBlocksA(fileA), indexB, lambda blockInfo: readBlock(fileB, blockInfo), [],
+			pathA, pathB, algorithm, cache, stats, report
+		)
+		stats['indexTime'] = indexTime
+
+# yield tasks (see blockTasks()) for files content in buffers
+def bufferTasks(bufA, bufB, nameA, nameB, algorithm, cache, stats, indexB=None, report=False, lineMaps=None):
+	blocksA = (
+		[blockId, startLine, memoryview(bufA)[startByte:endByte]]
+		for blockId, startLine, endLine, startByte, endByte in scanBlocks(bufA, innermostOnly=True)
+	)
+	startTime = time.perf_counter()
+	indexB = indexB or indexBlocksBuffer(bufB)
+	indexTime = time.perf_counter() - startTime
+	yield from blockTasks(
+		blocksA, indexB, lambda blockInfo: memoryview(bufB)[blockInfo[2]:blockInfo[3]], memoryview(b''),
+		nameA, nameB, algorithm, cache, stats, report, lineMaps
+	)
+	stats['indexTime'] = indexTime
+
+# yield tasks for runTasks() for blocks from blocksA iterator (readBlocksA() or scanBlocks() like) and corresponding blocks from fileB
+# (identical blocks are skipped), indexB is indexBlocks() or indexBlocksBuffer() result, readBlockB is function to get block content from index entry
+# first task is diff header (tag is None, result is header text, next element is stats dict)
+# other tasks are [blockA, blockB, aOffset, bOffset, blockId, result, cacheKey, record]
+# stats dict is filled with: paths, number of blocks in A, lists of blocks missing in B, duplicated in B, existing only in B
+# and used cache keys; number of changed blocks and added / removed lines are counted by writeResults()
+# when report is True stats['records'] is list of per block dicts (see reportRecord()), record is also set in task
+# lineMaps (see formatHunks()) is saved in stats['lineMaps']
+def blockTasks(blocksA, indexB, readBlockB, emptyBlock, pathA, pathB, algorithm, cache, stats, report=False, lineMaps=None):
+	blocksB, duplicatedB, lengthB = indexB
+	seenA = set()
+	useCache = cache is not None and algorithm != "external"
+	stats.update({
+		'pathA': pathA, 'pathB': pathB, 'blocks': 0, 'changed': 0, 'added': 0, 'removed': 0,
+		'missing': [], 'duplicated': duplicatedB, 'onlyInB': [], 'cacheKeys': [], 'lineMaps': lineMaps,
+	})
+	if report:
+		stats['records'] = []
+	
+	# print diff header (info abiut compared files)
+	yield [None, None, 0, 0, None, "--- " + pathA + "\n+++ " + pathB + "\n", stats, None]
+	
+	# get all blocks from first file and corresponding blocks from second file, skip identical blocks
+	for blockId, aOffset, blockA in blocksA:
+		startTime = time.perf_counter()
+		seenA.add(blockId)
+		stats['blocks'] += 1
+		if blockId in blocksB:
+			blockB  = readBlockB(blocksB[blockId])
+			bOffset = blocksB[blockId][0]
+		else:
+			stats['missing'].append(blockId)
+			blockB  = emptyBlock
+			bOffset = lengthB
+		if useCache:
+			hashA, hashB = blockHash(blockA), blockHash(blockB)
+		
+		record = None
+		if report:
+			record = reportRecord(blockId, aOffset, blockA, blocksB.get(blockId), time.perf_counter() - startTime, lineMaps)
+			stats['records'].append(record)
+		
+		if not useCache:
+			if blockA != blockB:
+				yield [blockA, blockB, aOffset, bOffset, blockId, None, None, record]
+			continue
+		if hashA == hashB:
+			continue
+		key = algorithm + ":" + hashA + ":" + hashB
+		stats['cacheKeys'].append(key)
+		if key in cache:
+			if record is not None:
+				record['cached'] = True
+			yield [None, None, aOffset, bOffset, blockId, cache[key], None, record]
+		else:
+			yield [blockA, blockB, aOffset, bOffset, blockId, None, key, record]
+	
+	stats['onlyInB'] = [b for b in sorted(blocksB, key=lambda b: blocksB[b][0]) if b not in seenA]
+
+# write results of tasks (from runTasks()) to out, update stats dicts and add new results to cache
+def writeResults(tasks, out, algorithm, cache):
+	for t in tasks:
+		if t[4] is None:
+			stats = t[6]
+			out.write(t[5])
+			continue
+		if isinstance(t[5], UnicodeDecodeError):
+			stats['failed'] = "can't compare " + stats['pathA'] + " with " + stats['pathB'] + ": " + str(t[5])
+			continue
+		if algorithm == "external":
+			txt = t[5]
+		else:
+			txt = formatHunks(t[5], t[2], t[3], t[4], stats['lineMaps'])
+			if t[6]:
+				cache[t[6]] = t[5]
+		if txt:
+			added, removed = 0, 0
+			for l in txt.split('\n'):
+				if l[:1] == '+':
+					added += 1
+				elif l[:1] == '-':
+					removed += 1
+			stats['changed'] += 1
+			stats['added']   += added
+			stats['removed'] += removed
+			if t[7] is not None:
+				t[7].update({'changed': True, 'added': added, 'removed': removed})
+		out.write(txt)
+
+# create --report record for block
+# blockInfo is entry from blocks index of fileB or None when block is missing in B, locateTime is time of finding block in B
+# lineMaps (see formatHunks()) is used to convert lines ranges to source files line numbers
+def reportRecord(blockId, aOffset, blockA, blockInfo, locateTime, lineMaps=None):
+	if isinstance(blockA, list):
+		linesA = len(blockA)
+	else:
+		linesA = bytes(blockA).count(b'\n') + (1 if blockA[-1:] not in (b'', b'\n') else 0)
+	rangeA = [aOffset + 1, aOffset + linesA]
+	rangeB = [blockInfo[0] + 1, blockInfo[1] + 1] if blockInfo else None
+	if lineMaps:
+		rangeA = [lineMaps[0][n - 1] for n in rangeA]
+		rangeB = rangeB and [lineMaps[1][n - 1] for n in rangeB]
+	return {
+		'block': blockId,
+		'a': rangeA,
+		'b': rangeB,
+		'missing': blockInfo is None,
+		'changed': False,
+		'cached': False,
+		'added': 0,
+		'removed': 0,
+		'locateTime': locateTime,
+		'diffTime': 0.0,
+	}
+
+# write --report file -- JSON with per file and per block statistics for compareMany() results and aggregate totals
+def saveReport(path, allStats, algorithm, totalTime):
+	files, blocks = [], []
+	for stats in allStats:
+		files.append({
+			'pathA': stats['pathA'],
+			'pathB': stats['pathB'],
+			'blocks': stats['blocks'],
+			'changed': stats['changed'],
+			'added': stats['added'],
+			'removed': stats['removed'],
+			'missing': len(stats['missing']),
+			'duplicated': stats['duplicated'],
+			'onlyInB': stats['onlyInB'],
+			'indexTime': stats['indexTime'],
+			'failed': stats.get('failed'),
+		})
+		for record in stats['records']:
+			blocks.append(dict(record, file=stats['pathA']))
+	totals = {
+		'files': len(files),
+		'algorithm': algorithm,
+		'time': totalTime,
+		'indexTime': sum(f['indexTime'] for f in files),
+		'locateTime': sum(b['locateTime'] for b in blocks),
+		'diffTime': sum(b['diffTime'] for b in blocks),
+	}
+	for key in ('blocks', 'changed', 'added', 'removed', 'missing'):
+		totals[key] = sum(f[key] for f in files)
+	totals['duplicated'] = sum(len(f['duplicated']) for f in files)
+	totals['onlyInB'] = sum(len(f['onlyInB']) for f in files)
+	totals['cached'] = sum(1 for b in blocks if b['cached'])
+	totals['failed'] = sum(1 for f in files if f['failed'])
+	with open(path, "w") as f:
+		json.dump({'files': files, 'blocks': blocks, 'totals': totals}, f, indent=1)
+
+# print warnings about blocks problems returned by compareFiles() (and about compare error)
+def printWarnings(pathB, problems):
+	if problems.get('failed'):
+		print("WARNING: " + problems['failed'], file=sys.stderr)
+	for blockId in problems['missing']:
+		print("WARNING: block \"" + blockId + "\" missing in " + pathB, file=sys.stderr)
+	for blockId in problems['duplicated']:
+		print("WARNING: block \"" + blockId + "\" duplicated in " + pathB + " (use first one)", file=sys.stderr)
+	for blockId in problems['onlyInB']:
+		print("WARNING: block \"" + blockId + "\" exists only in " + pathB, file=sys.stderr)
+
+# print summary line for stats dict (or list of stats dicts) returned by compareFiles() / compareMany()
+def printSummary(name, stats):
+	if isinstance(stats, dict):
+		stats = [stats]
+	failed = sum(1 for s in stats if s.get('failed'))
+	print("%s: %d blocks, %d changed (+%d -%d lines), %d missing, %d duplicated, %d only in B%s" % (
+		name,
+		sum(s['blocks'] for s in stats), sum(s['changed'] for s in stats),
+		sum(s['added'] for s in stats), sum(s['removed'] for s in stats),
+		sum(len(s['missing']) for s in stats), sum(len(s['duplicated']) for s in stats), sum(len(s['onlyInB']) for s in stats),
+		", %d failed" % failed if failed else ""
+	), file=sys.stderr)
+
+
+# build list of files pairs for directories dirA and dirB -- all files from dirA (matching one of patterns)
+# with file with the same relative path in dirB, return pairs list and lists of files existing only in dirA / dirB
+def treePairs(dirA, dirB, patterns=("*",)):
+	def listFiles(top):
+		files = []
+		for path, dirs, names in os.walk(top):
+			dirs.sort()
+			for name in sorted(names):
+				if any(fnmatch.fnmatch(name, p) for p in patterns):
+					files.append(os.path.relpath(os.path.join(path, name), top))
+		return files
+	filesA, filesB = listFiles(dirA), listFiles(dirB)
+	setA, setB = set(filesA), set(filesB)
+	pairs = [[os.path.join(dirA, f), os.path.join(dirB, f)] for f in filesA if f in setB]
+	return pairs, [os.path.join(dirA, f) for f in filesA if f not in setB], [os.path.join(dirB, f) for f in filesB if f not in setA]
+
+# read manifest file -- one pair of files per line (pathA and pathB separated by tab or spaces)
+# empty lines and lines started by # are ignored, return pairs list and list of not existing files
+def readManifest(path):
+	pairs, missing = [], []
+	with open(path, "r") as f:
+		for l in f:
+			l = l.strip()
+			if not l or l[0] == '#':
+				continue
+			pair = l.split('\t') if '\t' in l else l.split()
+			if len(pair) != 2:
+				raise ValueError("invalid manifest line: " + l)
+			for p in pair:
+				if not os.path.isfile(p):
+					missing.append(p)
+			if os.path.isfile(pair[0]) and os.path.isfile(pair[1]):
+				pairs.append(pair)
+	return pairs, missing
+
+
+if __name__ == "__main__":
+	# check args
+	argParser = argparse.ArgumentParser(
+		description="compare all BEGIN/END block from fileA to corresponding block in fileB;"
+		            " when fileA and fileB are directories compare all files from fileA with the same files in fileB"
+	)
+	argParser.add_argument("fileA", nargs="?")
+	argParser.add_argument("fileB", nargs="?")
+	argParser.add_argument("--manifest", metavar="FILE",
+		help="compare all pairs of files listed in FILE (one pair per line, separated by tab or spaces) instead of fileA and fileB")
+	argParser.add_argument("--include", action="append", metavar="PATTERN",
+		help="(for directories) compare only files with name matching shell PATTERN (can be used multiple times, default: all files)")
+	argParser.add_argument("--external-diff", action="store_true",
+		help="use external `diff -u | awk` pipeline (one shell process per block) instead of built-in diff engine"
+		     " (the same as --algorithm external)")
+	argParser.add_argument("--algorithm", default="myers", choices=("myers", "difflib", "patience", "histogram", "auto", "external"),
+		help="diff algorithm: myers (default, minimal diff as `diff -u`), difflib (Python difflib.SequenceMatcher, not minimal),"
+		     " patience or histogram (faster and more readable for large blocks with many repeated lines),"
+		     " auto (histogram for blocks longer than %d lines, myers for other)" % autoMaxLines)
+	argParser.add_argument("--mmap", action="store_true",
+		help="mmap input files and compare blocks without reading whole files into memory (for very large inputs)")
+	argParser.add_argument("-j", "--jobs", type=int, default=1, metavar="N",
+		help="compare blocks in N worker processes (0 = number of CPUs), output order is the same as for serial run")
+	argParser.add_argument("--cache", metavar="FILE",
+		help="keep blocks hashes and diff results in FILE, on rerun compare only blocks changed since previous run"
+		     " (ignored for external diff)")
+	argParser.add_argument("-n", "--normalize", action="store_true",
+		help="normalize .tex, .xml, .xhtml and .html files (as untex.py / unxml.py) before comparing,"
+		     " line numbers in hunks headers point to source files (other files are compared as is)")
+	argParser.add_argument("--report", metavar="FILE",
+		help="write JSON statistics to FILE: per block record (name, lines ranges in A and B, added / removed lines,"
+		     " missing in B, time of locating and comparing block) and aggregate totals")
+	args = argParser.parse_args()
+	startTime = time.perf_counter()
+	
+	pairs, fileWarnings = None, []
+	if args.manifest:
+		if args.fileA or args.fileB:
+			argParser.error("fileA and fileB can't be used with --manifest")
+		pairs, missing = readManifest(args.manifest)
+		fileWarnings += ["file " + path + " not found" for path in missing]
+	elif not args.fileA or not args.fileB:
+		argParser.error("fileA and fileB (or --manifest) are required")
+	elif os.path.isdir(args.fileA) and os.path.isdir(args.fileB):
+		pairs, onlyInA, onlyInB = treePairs(args.fileA, args.fileB, args.include or ("*",))
+		fileWarnings += ["file " + path + " missing in " + args.fileB for path in onlyInA]
+		fileWarnings += ["file " + path + " exists only in " + args.fileB for path in onlyInB]
+	
+	if args.external_diff:
+		args.algorithm = "external"
+	if args.normalize and args.algorithm == "external":
+		argParser.error("--normalize can't be used with external diff")
+	
+	pool = None
+	if args.jobs != 1:
+		pool = ProcessPoolExecutor(args.jobs or os.cpu_count())
+	
+	cache = None
+	if args.cache and args.algorithm != "external":
+		cache = loadCache(args.cache)
+	
+	if pairs is None:
+		allStats = [compareFiles(args.fileA, args.fileB, sys.stdout, pool, args.mmap, args.algorithm, cache, bool(args.report), args.normalize)]
+		sys.stdout.flush()
+		printWarnings(args.fileB, allStats[0])
+	else:
+		allStats = compareMany(pairs, sys.stdout, pool, args.mmap, args.algorithm, cache, bool(args.report), args.normalize)
+		sys.stdout.flush()
+		for stats in allStats:
+			printWarnings(stats['pathB'], stats)
+		for warning in fileWarnings:
+			print("WARNING: " + warning, file=sys.stderr)
+		for stats in allStats:
+			printSummary(stats['pathA'], stats)
+		printSummary("TOTAL (%d files)" % len(allStats), allStats)
+	
+	if cache is not None:
+		saveCache(args.cache, {key: cache[key] for stats in allStats for key in stats['cacheKeys']})
+	
+	if args.report:
+		saveReport(args.report, allStats, args.algorithm, time.perf_counter() - startTime)
+	
+	if pool:
+		pool.shutdown()
+	
+	if any(stats['failed'] for stats in allStats):
+		sys.exit(1)
@@ -1,10 +1,10 @@
 #!/bin/bash
 
 # run unxml.py, untex.py and diff.py on each input files update
+# (wrapper for diff_watch.py -- do all this in single long-running process, result is written to /tmp/XX.diff)
 
 # script dependencies:
-#  - inotifywait  (inotify-tools package)
-#  - diff.py, untex.py, unxml.py (from this repo, should be place in the same directory as this script)
+#  - diff_watch.py, diff.py, normalize.py (from this repo, should be place in the same directory as this script)
 
 
 # Copyright (c) 2019 Robert Ryszard Paciorek <rrp@opcode.eu.org>
@@ -31,31 +31,9 @@
 
 toolsDir=$(dirname $(realpath $0))
 
-toText() {
-	name=`basename "$1"`
-	nn=${name%.*}
-	case ${name#$nn} in
-		".xhtml"|".xml"|".html")
-			$toolsDir/unxml.py "$1"
-			;;
-		".tex")
-			$toolsDir/untex.py "$1"
-			;;
-		*)
-			echo "$1 don't have supported extension" > /dev/stderr
-			exit 1
-			;;
-	esac
-}
+if [ $# -ne 2 ]; then
+	echo "USAGE: $0 fileA fileB" > /dev/stderr
+	exit 1
+fi
 
-doCompare() {
-	toText "$1" > /tmp/`basename "$1"`;
-	toText "$2" > /tmp/`basename "$2"`;
-	$toolsDir/diff.py /tmp/`basename "$1"` /tmp/`basename "$2"` > /tmp/XX.diff;
-	echo "/tmp/XX.diff updated on `date --utc +'%F %T %Z'`"
-}
-
-doCompare "$1" "$2"
-while inotifywait "$1" "$2"; do
-	doCompare "$1" "$2"
-done
+exec $toolsDir/diff_watch.py -o /tmp/XX.diff "$1" "$2"
@@ -0,0 +1,194 @@
+#!/usr/bin/python3
+
+# watch two files (.tex / .xml / .xhtml / .html) and on each change normalize them (as untex.py / unxml.py)
+# and compare by sections (as diff.py) -- all in single long-running process:
+#  * line numbers in diff hunks headers point to source files (not to normalized text)
+#  * normalized text, fileB blocks index and diff results for unchanged blocks are kept in memory
+#  * only changed file is normalized again
+#  * bursts of events (e.g. editor save) are joined into single update
+#  * output diff file is replaced atomically
+
+# script dependencies:
+#  - diff.py, normalize.py (from this repo, should be place in the same directory as this script)
+#  - inotify (Linux) -- used via libc, without it script fall back to polling files state
+
+
+# Copyright (c) 2019 Robert Ryszard Paciorek <rrp@opcode.eu.org>
+# 
+# MIT License
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import sys, os, time, select, struct, argparse
+import ctypes, ctypes.util
+
+from xml.parsers.expat import ExpatError
+
+import diff, normalize
+
+# inotify constants (from sys/inotify.h)
+IN_MODIFY      = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO    = 0x00000080
+IN_CREATE      = 0x00000100
+IN_NONBLOCK    = os.O_NONBLOCK
+
+# init inotify for watching paths, return inotify file descriptor and dict: watch descriptor -> {file name: path}
+# watch directories (not files), because editors often save file by rename of temporary file
+def inotifyInit(paths):
+	libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+	fd = libc.inotify_init1(IN_NONBLOCK)
+	if fd < 0:
+		raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+	
+	watched = {}  # watch descriptor -> {file name in directory: path}
+	for path in paths:
+		dirName, fileName = os.path.split(os.path.abspath(path))
+		wd = libc.inotify_add_watch(fd, dirName.encode(), IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE)
+		if wd < 0:
+			raise OSError(ctypes.get_errno(), "inotify_add_watch failed for " + dirName)
+		watched.setdefault(wd, {})[fileName.encode()] = path
+	return fd, watched
+
+# wait for changes of files using inotify (initialized by inotifyInit()), yield sets of changed paths
+def inotifyWatch(fd, watched, debounce):
+	def readEvents():
+		changed = set()
+		try:
+			data = os.read(fd, 65536)
+		except BlockingIOError:
+			return changed
+		pos = 0
+		while pos < len(data):
+			wd, mask, cookie, nameLen = struct.unpack_from("iIII", data, pos)
+			name = data[pos+16 : pos+16+nameLen].rstrip(b'\0')
+			pos += 16 + nameLen
+			if name in watched.get(wd, {}):
+				changed.add(watched[wd][name])
+		return changed
+	
+	while True:
+		select.select([fd], [], [])
+		changed = readEvents()
+		# debounce -- wait for end of events burst
+		while changed and select.select([fd], [], [], debounce)[0]:
+			changed |= readEvents()
+		if changed:
+			yield changed
+
+# wait for changes of files by checking its state (mtime, size, inode) every interval seconds, yield sets of changed paths
+def pollWatch(paths, interval, debounce):
+	def getState(path):
+		try:
+			st = os.stat(path)
+			return (st.st_mtime_ns, st.st_size, st.st_ino)
+		except OSError:
+			return None
+	
+	states = {path: getState(path) for path in paths}
+	while True:
+		time.sleep(interval)
+		changed = {path for path in paths if getState(path) != states[path]}
+		# debounce -- wait until files stop changing
+		while changed:
+			for path in changed:
+				states[path] = getState(path)
+			time.sleep(debounce)
+			if all(getState(path) == states[path] for path in paths):
+				break
+			changed |= {path for path in paths if getState(path) != states[path]}
+		if changed:
+			yield changed
+
+
+# normalize files, compare and write diff (atomically) to outputPath
+# state is updated only when all changed files are normalized, otherwise they are normalized again on next update
+def update(state, changed, outputPath):
+	startTime = time.time()
+	changed = set(changed) | state.pop('pending', set())
+	normalized = {}
+	for path in changed:
+		try:
+			normalized[path] = normalize.normalizeFile(path)
+		except (OSError, ValueError, ExpatError) as e:
+			# file can be temporary missing, not well-formed or with incomplete UTF-8 sequence during save / edit
+			print("Can't read " + path + ": " + str(e), file=sys.stderr)
+			state['pending'] = changed
+			return False
+	state.update(normalized)
+	pathA, pathB = state['paths']
+	(bufA, lineMapA), (bufB, lineMapB) = state[pathA], state[pathB]
+	if pathB in changed:
+		state['indexB'] = diff.indexBlocksBuffer(bufB)
+	
+	with open(outputPath + ".tmp", "w") as out:
+		problems = diff.compareBuffers(
+			bufA, bufB, pathA, pathB, out, algorithm=state['algorithm'], cache=state['cache'],
+			indexB=state['indexB'], lineMaps=[lineMapA, lineMapB]
+		)
+	os.replace(outputPath + ".tmp", outputPath)
+	
+	# keep in cache only results for actual blocks
+	state['cache'] = {key: state['cache'][key] for key in problems['cacheKeys']}
+	
+	diff.printWarnings(pathB, problems)
+	print(outputPath + " updated on " + time.strftime('%F %T UTC', time.gmtime()) + " (%.3f s)" % (time.time() - startTime))
+	sys.stdout.flush()
+	return True
+
+
+if __name__ == "__main__":
+	argParser = argparse.ArgumentParser(
+		description="watch fileA and fileB, on each change normalize them (as untex.py / unxml.py) and compare by sections (as diff.py)"
+	)
+	argParser.add_argument("fileA")
+	argParser.add_argument("fileB")
+	argParser.add_argument("-o", "--output", default="/tmp/XX.diff",
+		help="output diff file (default: %(default)s)")
+	argParser.add_argument("--debounce", type=float, default=0.1, metavar="SECONDS",
+		help="wait for SECONDS without new events before update (default: %(default)s)")
+	argParser.add_argument("--poll", type=float, metavar="SECONDS",
+		help="don't use inotify, check files state every SECONDS")
+	argParser.add_argument("--algorithm", default="myers", choices=("myers", "difflib", "patience", "histogram", "auto"),
+		help="diff algorithm (see diff.py --help)")
+	args = argParser.parse_args()
+	
+	for path in (args.fileA, args.fileB):
+		if os.path.splitext(path)[1] not in normalize.normalizers:
+			print(path + " don't have supported extension", file=sys.stderr)
+			exit(1)
+	
+	state = {'paths': (args.fileA, args.fileB), 'cache': {}, 'indexB': None, 'algorithm': args.algorithm}
+	if not update(state, {args.fileA, args.fileB}, args.output):
+		exit(1)
+	
+	if args.poll:
+		watcher = pollWatch((args.fileA, args.fileB), args.poll, args.debounce)
+	else:
+		try:
+			watcher = inotifyWatch(*inotifyInit((args.fileA, args.fileB)), args.debounce)
+		except (OSError, AttributeError) as e:
+			print("inotify not available (" + str(e) + "), use polling", file=sys.stderr)
+			watcher = pollWatch((args.fileA, args.fileB), 0.5, args.debounce)
+	
+	try:
+		for changed in watcher:
+			update(state, changed, args.output)
+	except KeyboardInterrupt:
+		pass
@@ -0,0 +1,399 @@
+#!/usr/bin/python3
+
+# normalize TeX and XML files for comparing by diff.py -- library used by untex.py, unxml.py, diff.py and diff_watch.py
+# normalizeTex(), normalizeXml() and normalizeXmlRegex() generators yield [sourceLineNumber, normalizedLine]
+# for all not empty normalized lines, so diff results can be reported with line numbers of source files
+#
+# run as script: normalize all files from directory tree in parallel, with on-disk cache of results
+# (on rerun only changed files are normalized)
+
+# Copyright (c) 2019 Robert Ryszard Paciorek <rrp@opcode.eu.org>
+# 
+# MIT License
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import sys, os, io, re, time, json, hashlib, argparse
+import xml.parsers.expat
+from concurrent.futures import ProcessPoolExecutor
+
+
+# normalize white spaces in line, return None for empty lines
+def normalizeSpaces(l):
+	# replace tabs, no-break spaces and sequences of spaces by single space
+	if '\t' in l:
+		l = l.replace('\t', ' ')
+	if '\u00a0' in l:
+		l = l.replace('\u00a0', ' ')
+	while '  ' in l:
+		l = l.replace('  ', ' ')
+	if l[:1] == ' ':
+		l = l[1:]
+	l = l.replace(' \n', '\n')
+	if l != '\n':
+		return l
+
+
+#
+# TeX
+#
+
+group1      = lambda m: m.group(1)        # replacement functions (faster than r'\1' templates)
+group1Space = lambda m: m.group(1) + ' '
+
+# TeX markup removing rules -- [literal, regex, replacement], applied in order to each line
+# every regex match contains literal, so regex is run only on lines containing it (most rules are skipped on most lines)
+texRules = [[literal, re.compile(regex), repl] for literal, regex, repl in (
+	("\\begin",      r'\\begin(\{.*?\})*',           ''),
+	("\\end{",       r'\\end\{.*?\}',                 ''),
+	("\\label{",     r'\\label\{.*?\}',               ''),
+	
+	("section{",     r'\\[a-z]*section\{(.*?)\}',      group1),
+	("\\lstinline{", r'\\lstinline\{(.*?)\}',          group1),
+	("\\lstinline@", r'\\lstinline@(.*?)@',            group1),
+	("\\text",       r'\\text..\{(.*?)\}',             group1),
+	("{\\it ",       r'\{\\it (.*?)\}',                group1),
+	("{\\bf ",       r'\{\\bf (.*?)\}',                group1),
+	("~",            r'([^\\])~',                     group1Space),
+	
+	("space{",       r'\\.space\{.*?\}',               ''),
+	("\\itemsep{",   r'\\itemsep\{.*?\}',             ''),
+	(",,",           r',,',                            ''),
+	("''",           r"''",                            ''),
+	
+	("\\",           r'\\[\\a-zA-Z]+(\[.*?\])*',       ''),
+)]
+
+mathMark = "@@%%@@"  # temporary replacement for backslashes in math mode
+
+
+# replace backslashes in inline math ($...$) by mathMark to protect math commands from removing
+# backslashes are protected only when first $...$ on line contains backslash, and in this first $...$
+# only last backslash is protected (unless line starts with $) -- this keeps output compatible with older versions
+def protectMath(l):
+	parts = l.split('$')
+	if len(parts) < 3 or '\\' not in parts[1]:
+		return l
+	if parts[0]:
+		i = parts[1].rfind('\\')
+		parts[1] = parts[1][:i] + mathMark + parts[1][i+1:]
+		start = 3
+	else:
+		start = 1
+	for i in range(start, len(parts) - 1, 2):
+		parts[i] = parts[i].replace('\\', mathMark)
+	return '$'.join(parts)
+
+# remove TeX tags from lines, yield [sourceLineNumber, normalizedLine] (empty lines are skipped)
+def normalizeTex(lines):
+	for lineNo, l in enumerate(lines, 1):
+		if '$' in l:
+			l = protectMath(l)
+		for literal, regex, repl in texRules:
+			if literal in l:
+				l = regex.sub(repl, l)
+		if mathMark in l:
+			l = l.replace(mathMark, '\\')
+		
+		l = normalizeSpaces(l)
+		if l is not None:
+			yield lineNo, l
+
+
+#
+# XML
+#
+
+# pomocnicze funkcje do konwertowania encji
+# obsługujemy tu tylko 5 predefiniowanych w XML -- jedna tabela dla obu kierunków konwersji
+entities = {'&lt;': '<', '&gt;': '>', '&quot;': '"', '&apos;': "'", '&amp;': '&'}
+entitiesRegex   = re.compile('|'.join(entities))
+charsTable      = str.maketrans({c: e for e, c in entities.items() if c in '&<>'})
+charsTableFull  = str.maketrans({c: e for e, c in entities.items()})
+
+def entitiesToChars(txt):
+	if '&' not in txt:
+		return txt
+	return entitiesRegex.sub(lambda m: entities[m.group(0)], txt)
+
+def charsToEntities(txt, full=False):
+	return txt.translate(charsTableFull if full else charsTable)
+
+
+imgRegex     = re.compile('<img.*?src="(.*?)".*?>')
+mathRegex    = re.compile('<m>(.*?)</m>')
+commentRegex = re.compile('<!--(.*?)-->')
+tagRegex     = re.compile('<.*?>')
+
+# replace <img> by src, <m> by $...$ and </dt><dd> by " -- ", remove other tags and convert entities in single line
+# (comments are converted to "%" + comment text before removing tags when withComments is True)
+def stripTags(l, withComments=False):
+	if '<' in l:
+		l = imgRegex.sub('\\1', l)
+		l = mathRegex.sub('$\\1$', l)
+		l = l.replace('</dt><dd>', ' -- ')
+		if withComments:
+			l = commentRegex.sub('%\\1', l)
+		l = tagRegex.sub('', l)
+	return entitiesToChars(l)
+
+# remove XML tags from lines, yield [sourceLineNumber, normalizedLine] (empty lines are skipped)
+# work line by line, so tags and comments must be in single line, but input don't need to be well-formed XML
+def normalizeXmlRegex(lines):
+	for lineNo, l in enumerate(lines, 1):
+		l = normalizeSpaces(stripTags(l, True))
+		if l is not None:
+			yield lineNo, l
+
+# remove XML tags from well-formed XML document given as iterator of lines (or any other text chunks),
+# yield [sourceLineNumber, normalizedLine] -- the same as normalizeXmlRegex(), but tags and comments can span multiple lines
+# (line number is number of line where normalized line starts, including removed tags)
+# document is parsed by expat in streaming mode, so memory usage don't depend on document size
+def normalizeXml(lines):
+	parser = xml.parsers.expat.ParserCreate()
+	parser.UseForeignDTD(True)  # don't fail on entities from (not loaded) DTD, see SkippedEntityHandler
+	
+	current, ready = [], []  # fragments of current output line, complete output lines
+	lineNo  = 1              # source line number of current output line
+	afterDT = False          # last event was </dt> (for </dt><dd> -> " -- ")
+	
+	def write(txt):
+		nonlocal afterDT, lineNo
+		afterDT = False
+		if '\n' not in txt:
+			current.append(txt)
+			return
+		txt = txt.split('\n')
+		current.append(txt[0])
+		for i, part in enumerate(txt[1:], parser.CurrentLineNumber + 1):
+			l = normalizeSpaces(''.join(current) + '\n')
+			if l is not None:
+				ready.append((lineNo, l))
+			current[:] = [part]
+			lineNo = i
+	
+	def startElement(name, attrs):
+		if name == 'img':
+			write(attrs.get('src', ''))
+		elif name == 'm':
+			write('$')
+		elif name == 'dd' and afterDT and not attrs:
+			write(' -- ')
+		else:
+			write('')
+	
+	def endElement(name):
+		nonlocal afterDT
+		if name == 'm':
+			write('$')
+		else:
+			write('')
+		afterDT = (name == 'dt')
+	
+	def comment(data):
+		# tags and entities in comment are converted as in text (as in normalizeXmlRegex())
+		write('\n'.join('%' + stripTags(l) for l in data.split('\n')))
+	
+	parser.StartElementHandler   = startElement
+	parser.EndElementHandler     = endElement
+	parser.CharacterDataHandler  = write
+	parser.CommentHandler        = comment
+	parser.SkippedEntityHandler  = lambda name, isParameterEntity: write('&' + name + ';')
+	# new lines outside root element (between prolog / epilog comments) are reported only to default handler
+	parser.DefaultHandlerExpand  = lambda data: write(data) if data.isspace() else None
+	
+	for l in lines:
+		parser.Parse(l, False)
+		yield from ready
+		ready.clear()
+	parser.Parse('', True)
+	yield from ready
+	l = ''.join(current)
+	if l:
+		l = normalizeSpaces(l)
+		if l is not None:
+			yield lineNo, l
+
+
+# map filename extension -> normalizing function
+normalizers = {
+	".xhtml": normalizeXml,
+	".xml":   normalizeXml,
+	".html":  normalizeXmlRegex,  # HTML don't need to be well-formed XML
+	".tex":   normalizeTex,
+}
+
+# normalize file (by normalizing function selected by filename extension)
+# return normalized text (as bytes, for diff.compareBuffers()) and list of source line numbers for all normalized lines
+# raise KeyError for not supported extension, OSError and xml.parsers.expat.ExpatError on read / parse errors
+def normalizeFile(path):
+	ext = os.path.splitext(path)[1]
+	if ext not in normalizers:
+		raise KeyError(ext)
+	with open(path, "rb") as f:
+		return normalizeData(f.read(), ext)
+
+# as normalizeFile(), but for file content (bytes) and filename extension
+def normalizeData(data, ext):
+	# decode and split lines as open(path, "r")
+	lines = list(normalizers[ext](io.TextIOWrapper(io.BytesIO(data))))
+	return ''.join(l for lineNo, l in lines).encode(), [lineNo for lineNo, l in lines]
+
+
+#
+# normalizing whole directory tree (with cache of results)
+#
+
+# version of normalizing code for cache keys -- hash of this file, so any change of normalizing rules invalidates cache
+with open(__file__, "rb") as f:
+	normalizerVersion = hashlib.blake2b(f.read(), digest_size=8).hexdigest()
+
+# cache key for file content -- hash of normalizer version, filename extension (selects normalizer) and file content
+def cacheKey(data, ext):
+	h = hashlib.blake2b(digest_size=20)
+	h.update((normalizerVersion + ext + "\0").encode())
+	h.update(data)
+	return h.hexdigest()
+
+def cachePath(cacheDir, key):
+	return os.path.join(cacheDir, key[:2], key)
+
+# write file atomically (via rename), create parent directories when needed
+def writeFile(path, data):
+	os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+	tmpPath = path + ".tmp%d" % os.getpid()
+	with open(tmpPath, "wb") as f:
+		f.write(data)
+	os.replace(tmpPath, path)
+
+# (worker task) normalize srcPath, write result to outPath and to cache, return cache key of normalized content
+def normalizeToFile(srcPath, outPath, cacheDir):
+	ext = os.path.splitext(srcPath)[1]
+	with open(srcPath, "rb") as f:
+		data = f.read()
+	key = cacheKey(data, ext)
+	txt = normalizeData(data, ext)[0]
+	if cacheDir:
+		writeFile(cachePath(cacheDir, key), txt)
+	writeFile(outPath, txt)
+	return key
+
+# normalize all files with supported extensions from srcDir to outDir (dir/file.tex -> dir/file.txt)
+# files are normalized in pool (concurrent.futures executor), results are saved in cacheDir (when not None) by cacheKey()
+# outDir/.normalize.json keeps cache keys of outputs, so output of unchanged file is not rewritten
+# outputs of removed and failed source files are deleted, return dict with numbers of files: unchanged, cached, normalized, failed, removed
+def normalizeTree(srcDir, outDir, pool, cacheDir=None):
+	indexPath = os.path.join(outDir, ".normalize.json")
+	try:
+		with open(indexPath, "r") as f:
+			index = json.load(f)  # output path (relative to outDir) -> cache key
+	except (OSError, ValueError):
+		index = {}
+	
+	newIndex, tasks, seen = {}, {}, set()
+	counts = dict.fromkeys(("unchanged", "cached", "normalized", "failed", "removed"), 0)
+	for path, dirs, names in os.walk(srcDir):
+		dirs.sort()
+		for name in sorted(names):
+			base, ext = os.path.splitext(name)
+			if ext not in normalizers:
+				continue
+			srcPath = os.path.join(path, name)
+			outName = os.path.relpath(os.path.join(path, base + ".txt"), srcDir)
+			outPath = os.path.join(outDir, outName)
+			if outName in seen:
+				print("WARNING: skip " + srcPath + " -- output file " + outPath + " is used by other file", file=sys.stderr)
+				continue
+			seen.add(outName)
+			
+			try:
+				with open(srcPath, "rb") as f:
+					key = cacheKey(f.read(), ext)
+			except OSError as e:  # e.g. dangling symlink, unreadable file
+				print("WARNING: can't normalize " + srcPath + ": " + str(e), file=sys.stderr)
+				counts['failed'] += 1
+				try:
+					os.remove(outPath)
+				except FileNotFoundError:
+					pass
+				continue
+			if index.get(outName) == key and os.path.exists(outPath):
+				counts['unchanged'] += 1
+			elif cacheDir and os.path.exists(cachePath(cacheDir, key)):
+				with open(cachePath(cacheDir, key), "rb") as f:
+					writeFile(outPath, f.read())
+				counts['cached'] += 1
+			else:
+				tasks[outName] = srcPath, pool.submit(normalizeToFile, srcPath, outPath, cacheDir)
+				continue
+			newIndex[outName] = key
+	
+	for outName, (srcPath, future) in tasks.items():
+		try:
+			newIndex[outName] = future.result()
+			counts['normalized'] += 1
+		except (OSError, ValueError, xml.parsers.expat.ExpatError) as e:
+			print("WARNING: can't normalize " + srcPath + ": " + str(e), file=sys.stderr)
+			counts['failed'] += 1
+			# don't leave output of previous (good) version of file
+			try:
+				os.remove(os.path.join(outDir, outName))
+			except FileNotFoundError:
+				pass
+	
+	for outName in index:
+		if outName not in seen:
+			try:
+				os.remove(os.path.join(outDir, outName))
+			except FileNotFoundError:
+				pass
+			counts['removed'] += 1
+	
+	writeFile(indexPath, json.dumps(newIndex, indent=0).encode())
+	return counts
+
+
+if __name__ == "__main__":
+	argParser = argparse.ArgumentParser(
+		description="normalize (as untex.py / unxml.py) all .tex, .xml, .xhtml and .html files from srcDir to outDir"
+		            " (dir/file.tex -> dir/file.txt), unchanged files are not normalized again"
+	)
+	argParser.add_argument("srcDir")
+	argParser.add_argument("outDir")
+	argParser.add_argument("-j", "--jobs", type=int, default=0, metavar="N",
+		help="normalize files in N worker processes (default: 0 = number of CPUs)")
+	argParser.add_argument("--cache", metavar="DIR",
+		default=os.path.join(os.environ.get("XDG_CACHE_HOME", os.path.expanduser("~/.cache")), "textutils", "normalize"),
+		help="directory for cache of normalized files (keyed by content hash and normalizer version, default: %(default)s)")
+	argParser.add_argument("--no-cache", action="store_true",
+		help="don't use cache directory (unchanged files are still detected by outDir/.normalize.json)")
+	args = argParser.parse_args()
+	
+	startTime = time.time()
+	with ProcessPoolExecutor(args.jobs or os.cpu_count()) as pool:
+		counts = normalizeTree(args.srcDir, args.outDir, pool, None if args.no_cache else args.cache)
+	print(
+		"%d files: %d unchanged, %d from cache, %d normalized, %d failed, %d removed (%.3f s)" % (
+			sum(counts[k] for k in ("unchanged", "cached", "normalized", "failed")),
+			counts['unchanged'], counts['cached'], counts['normalized'], counts['failed'], counts['removed'],
+			time.time() - startTime
+		), file=sys.stderr
+	)
+	if counts['failed']:
+		exit(1)
@@ -1,6 +1,7 @@
 #!/usr/bin/python3
 
 # simple TeX tags remover for unified input for diff.py
+# (command line interface for normalizeTex() from normalize.py)
 
 # Copyright (c) 2019 Robert Ryszard Paciorek <rrp@opcode.eu.org>
 # 
@@ -24,41 +25,20 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
-import sys, re
+import sys
 
-if len(sys.argv) == 2:
-	f = open(sys.argv[1])
-else:
-	f = sys.stdin
+from normalize import normalizeTex
 
 
-for l in f:
-	l, n = re.subn('^([^$]*)(\$[^$]*)\\\\([^$]*\$)', '\\1\\2@@%%@@\\3', l)
-	while n:
-		l, n = re.subn('^(([^$]*\$[^$]*\$[^$]*)*)(\$[^$]*)\\\\([^$]*\$)', '\\1\\3@@%%@@\\4', l)
-	l = re.sub('\\\\begin(\{.*?\})*', '', l)
-	l = re.sub('\\\\end\{.*?\}', '', l)
-	l = re.sub('\\\\label\{.*?\}', '', l)
-	
-	l = re.sub('\\\\[a-z]*section\{(.*?)\}', '\\1', l)
-	l = re.sub('\\\\lstinline\{(.*?)\}', '\\1', l)
-	l = re.sub('\\\\lstinline@(.*?)@', '\\1', l)
-	l = re.sub('\\\\text..\{(.*?)\}', '\\1', l)
-	l = re.sub('\{\\\\it (.*?)\}', '\\1', l)
-	l = re.sub('\{\\\\bf (.*?)\}', '\\1', l)
-	l = re.sub('([^\\\\])~', '\\1 ', l)
-	
-	l = re.sub('\\\\.space\{.*?\}', '', l)
-	l = re.sub('\\\\itemsep\{.*?\}', '', l)
-	l = re.sub(',,', '', l)
-	l = re.sub("''", '', l)
+# remove TeX tags from lines, yield normalized lines (empty lines are skipped)
+def untex(lines):
+	for lineNo, l in normalizeTex(lines):
+		yield l
 
-	l = re.sub('\\\\[\\\\a-zA-Z]+(\[.*?\])*', '', l)
-	l = re.sub('@@%%@@', '\\\\', l)
+if __name__ == "__main__":
+	if len(sys.argv) == 2:
+		f = open(sys.argv[1])
+	else:
+		f = sys.stdin
 	
-	l = re.sub('[  \t]+', ' ', l)
-	l = re.sub('^ ', '', l)
-	l = re.sub(' \n', '\n', l)
-	if l != '\n':
-		print(l, end="")
-
+	sys.stdout.writelines(untex(f))
@@ -1,6 +1,7 @@
 #!/usr/bin/python3
 
 # simple XML tags remover for unified input for diff.py
+# (command line interface for normalizeXmlRegex() and normalizeXml() from normalize.py)
 
 # Copyright (c) 2019 Robert Ryszard Paciorek <rrp@opcode.eu.org>
 # 
@@ -24,42 +25,45 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
-import sys, re
+import sys, argparse
+import xml.parsers.expat
 
-if len(sys.argv) == 2:
-	f = open(sys.argv[1])
-else:
-	f = sys.stdin
+from normalize import normalizeXml, normalizeXmlRegex, entitiesToChars, charsToEntities
 
-# pomocnicza funkcja do konwertowania encji
-# obsługujemy tu tylko 5 predefiniowanych w XML
-def entitiesToChars(txt):
-	entities = [ ['&lt;','<'], ['&gt;','>'], ['&quot;','"'], ['&apos;',"'"], ['&amp;','&'] ]
-	for entity in entities:
-		txt = txt.replace(entity[0], entity[1])
-	return txt
 
-def charsToEntities(txt, full=False):
-	entities  = [ ['&amp;','&'] ]
-	entities += [ ['&lt;','<'], ['&gt;','>'] ]
-	if full:
-		entities += [ ['&quot;','"'], ['&apos;',"'"] ]
-	for entity in entities:
-		txt = txt.replace(entity[1], entity[0])
-	return txt
+# remove XML tags from well-formed XML document given as iterator of lines (or any other text chunks),
+# yield normalized lines (empty lines are skipped), tags and comments can span multiple lines
+def unxml(lines):
+	for lineNo, l in normalizeXml(lines):
+		yield l
 
-for l in f:
-	l = re.sub('<img.*?src="(.*?)".*?>', '\\1', l)
-	l = re.sub('<m>(.*?)</m>', '$\\1$', l)
-	l = re.sub('</dt><dd>', ' -- ', l)
-	l = re.sub('<!--(.*?)-->', '%\\1', l)
-
-	l = re.sub('<.*?>', '', l)
-	l = entitiesToChars(l)
-
-	l = re.sub('[  \t]+', ' ', l)
-	l = re.sub('^ ', '', l)
-	l = re.sub(' \n', '\n', l)
-	if l != '\n':
-		print(l, end="")
+# remove XML tags line by line (input don't need to be well-formed XML), yield normalized lines
+def unxmlRegex(lines):
+	for lineNo, l in normalizeXmlRegex(lines):
+		yield l
 
+if __name__ == "__main__":
+	argParser = argparse.ArgumentParser(
+		description="remove XML tags from inputFile (default: stdin), convert <m> to $...$, <img> to src and comments to %..."
+	)
+	argParser.add_argument("inputFile", nargs="?")
+	argParser.add_argument("--stream", action="store_true",
+		help="parse input as XML by expat in streaming mode (tags and comments spanning multiple lines are removed),"
+		     " input must be well-formed XML document; default: process input line by line with regular expressions"
+		     " (works also for not well-formed documents, e.g. HTML)")
+	args = argParser.parse_args()
+	
+	if args.inputFile:
+		f = open(args.inputFile)
+	else:
+		f = sys.stdin
+	
+	if not args.stream:
+		sys.stdout.writelines(unxmlRegex(f))
+	else:
+		try:
+			sys.stdout.writelines(unxml(iter(lambda: f.read(1 << 16), '')))
+		except xml.parsers.expat.ExpatError as e:
+			sys.stdout.flush()
+			print("XML parse error: " + str(e) + " (run without --stream for not well-formed documents)", file=sys.stderr)
+			exit(1)
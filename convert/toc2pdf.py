@@ -29,13 +29,14 @@
 # SOFTWARE.
 
 import xml.etree.ElementTree as xmlParser
-import re, sys
+import sys, json, collections, unicodedata
 
 if len(sys.argv) != 3:
 	print("USAGE:", sys.argv[0], "xhtmlFile xmlFile", file=sys.stderr)
 	print("", file=sys.stderr)
 	print("generate table of content as pdftk bookmarks for pdfs generated from xhtml files", file=sys.stderr)
 	print(" xhtmlFile - source XHTML file for pdf (with hierarchy by <h2/> -- <h5/> tags)", file=sys.stderr)
+	print("             or its table of content (.json file) from `xml2xhtml.py --toc-json`", file=sys.stderr)
 	print(" xmlFile   - xml output from `pdftohtml -xml` command)", file=sys.stderr)
 	print("", file=sys.stderr)
 	print("USAGE EXAMPLE:", file=sys.stderr)
@@ -58,10 +59,8 @@ if sys.argv[2] != '-':
 	xmlFile = open(sys.argv[2], "r")
 
 
-# get TOC from xhtml file
+# get TOC from xhtml file (or from JSON file written by xml2xhtml.py, without parsing xhtml)
 
-xml = xmlParser.ElementTree()
-rootNode = xml.parse( xhtmlFile )
 toc = []
 
 def getTitle(element):
@@ -78,62 +77,100 @@ def tableOfContents(element, level):
 	for e in element:
 		tableOfContents(e, level)
 
-tableOfContents(rootNode, 1)
+# entries in JSON file are in the same order and with the same levels as from tableOfContents()
+def tableOfContentsJSON(entries):
+	for e in entries:
+		toc.append([e['title'], e['level']])
 
+if sys.argv[1].endswith(".json"):
+	tableOfContentsJSON(json.load(xhtmlFile))
+else:
+	xml = xmlParser.ElementTree()
+	rootNode = xml.parse( xhtmlFile )
+	tableOfContents(rootNode, 1)
 
-# get pages numbers based on xml file
 
-xml = xmlParser.ElementTree()
-rootNode = xml.parse( xmlFile )
-
-pages = {}
-fonts = []
-xmlTagRegex = re.compile('<.*?>')
-spacesRegex = re.compile('[ \t\n]+')
-
-for p in rootNode:
-	if p.tag == 'page':
-		pn = p.attrib['number']
-		
-		# find font used for titles
-		for e in p:
-			if e.tag == 'fontspec' and e.attrib['color'] == '#010101':
-				fonts.append(e.attrib['id'])
-		
-		# join all titles elements on single line
-		ptiles = {}
-		for e in p:
-			if e.tag == 'text' and e.attrib['font'] in fonts:
-				line = e.attrib['top']
-				# get full tag, because text can be inside child tags
-				txt = xmlParser.tostring(e, encoding="unicode")
-				# normalise whitespaces
-				txt = spacesRegex.sub(' ', txt)
-				# strip before remove xml to protect potential spaces at begin/end title element
-				txt = txt.strip()
-				# remove xml tags
-				txt = xmlTagRegex.sub('', txt)
-				# concat all title element on line
-				ptiles[line] = ptiles.get(line, "") + txt
-		
-		# add all (joined) titles from actual page to `pages` dict
-		for l in ptiles:
-			title = ptiles[l]
-			if title in pages:
-				pages[title].append(pn)
-			else:
-				pages[title] = [ pn ]
+# get pages numbers based on xml file
+# xml is read page by page (by iterparse) and each page is removed from memory after collecting its titles,
+# reading is stopped when page numbers for all TOC entries are found
+#
+# titles are matched by normalized text (see titleKey()), so differences in whitespaces (also missing space between
+# text elements) and unicode forms (e.g. ligatures) don't matter, title wrapped to few lines (also on next page)
+# is matched by joined text of consecutive titles lines
+
+# return key for matching title text -- NFKC normalized text without whitespaces
+def titleKey(text):
+	return ''.join(unicodedata.normalize('NFKC', text).split())
+
+needed = {}  # title key -> number of TOC entries with this title without found page
+for e in toc:
+	key = titleKey(e[0])
+	needed[key] = needed.get(key, 0) + 1
+missing = len(toc)
+
+pages = {}  # title key -> deque of page numbers (in document order)
+fonts = set()
+maxJoinedLines = 3
+previousLines = []  # [key, page number] for last (up to maxJoinedLines-1) not matched titles lines
+
+# add page number pn for line of title with key, when it is (alone or joined with previous lines) title from TOC
+def addTitleLine(key, pn):
+	global missing
+	for i in range(len(previousLines), -1, -1):
+		joinedKey = ''.join(l[0] for l in previousLines[i:]) + key
+		if needed.get(joinedKey):
+			needed[joinedKey] -= 1
+			missing -= 1
+			pages.setdefault(joinedKey, collections.deque()).append(previousLines[i][1] if i < len(previousLines) else pn)
+			del previousLines[:]
+			return
+	previousLines.append([key, pn])
+	del previousLines[:-(maxJoinedLines-1)]
+
+rootNode = None
+for event, p in xmlParser.iterparse(xmlFile, ("start", "end")):
+	if event == 'start':
+		if rootNode is None:
+			rootNode = p
+		continue
+	if p.tag != 'page':
+		continue
+	
+	pn = p.attrib['number']
+	
+	# find font used for titles
+	for e in p:
+		if e.tag == 'fontspec' and e.attrib['color'] == '#010101':
+			fonts.add(e.attrib['id'])
+	
+	# join all titles elements on single line (text can be inside child tags, e.g. <b>)
+	ptiles = {}
+	for e in p:
+		if e.tag == 'text' and e.attrib['font'] in fonts:
+			line = e.attrib['top']
+			ptiles[line] = ptiles.get(line, "") + ''.join(e.itertext())
+	
+	for line in ptiles:
+		key = titleKey(ptiles[line])
+		if key:
+			addTitleLine(key, pn)
+	
+	# free memory -- remove processed page
+	rootNode.clear()
+	if missing == 0:
+		break
 
 
 # add page numbers to TOC
+# (for not found titles print warning and use page of previous TOC entry)
 
+pn = "1"
 for e in toc:
-	title = e[0]
-	try:
-		pn = pages[title].pop(0)
-	except KeyError:
-		print(pages, file=sys.stderr)
-		raise BaseException("Can't find page number for: " + title)
+	queue = pages.get(titleKey(e[0]))
+	if queue:
+		pn = queue.popleft()
+	else:
+		print("Can't find page number for: " + e[0], file=sys.stderr)
 	e.append(pn)
 
 
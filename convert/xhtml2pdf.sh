@@ -62,7 +62,12 @@ chromium --headless --print-to-pdf="$TMP_PDF_OUT1" --no-pdf-header-footer -print
 # prepare TOC as PDF bookmarks
 TMP_TOC_DATA=`mktemp -t 'XXXXXXXXXXX.info'`
 pdftk $TMP_PDF_OUT1 dump_data > $TMP_TOC_DATA
-pdftohtml -xml -i -stdout $TMP_PDF_OUT1 | python3 $SRCDIR/toc2pdf.py "$input" - >> $TMP_TOC_DATA
+# use TOC written by `xml2xhtml.py --toc-json` (when it is up to date) instead of parsing whole XHTML again
+tocSource="$input"
+if [ -f "$input.toc.json" ] && ! [ "$input" -nt "$input.toc.json" ]; then
+	tocSource="$input.toc.json"
+fi
+pdftohtml -xml -i -stdout $TMP_PDF_OUT1 | python3 $SRCDIR/toc2pdf.py "$tocSource" - >> $TMP_TOC_DATA
 
 # add PDF bookmarks
 pdftk "$TMP_PDF_OUT1" update_info $TMP_TOC_DATA output $output
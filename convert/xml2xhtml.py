@@ -7,11 +7,19 @@
 #  * insert source code specifierd by <insertSourceCode> and prepare for highlight via CSS
 #  * create table of content
 #  * add <!DOCTYPE
+# document is converted in two streaming passes (first collects table of content), without building whole tree in memory
+# can convert many documents (pairs of input and output files or all .xml files from directory) in single process
+# results of equations conversion and source code highlighting are cached in memory and on disk (sqlite3 database)
+# unique (not cached) equations and source codes of document are converted in parallel (in worker processes) before writing output
+# can write make dependency file (with all files read during conversion) and table of content (for toc2pdf.py) for each output file
+# can write profile (times of conversion phases, counters, cache hits and slowest equations and source codes) as JSON
+# can be used as python module (see convert() and convertFile()) or as conversion server for xml2xhtml_client.py (see serve())
 
 # script dependencies:
 #  - python3
 #  - pygments python module (python3-pygments package)
 #  - latex2mathml python module (https://github.com/roniemartinez/latex2mathml, instal via `pip3 install latex2mathml`)
+#  - xml2xhtml_socket.py (from this repo, should be place in the same directory as this script)
 
 
 # Copyright (c) 2019 Robert Ryszard Paciorek <rrp@opcode.eu.org>
@@ -36,58 +44,88 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
-import re, sys, os
+import re, sys, os, time, copy, json, shutil, tempfile, argparse, functools, hashlib
 import xml.etree.ElementTree as xmlParser
+import xml.parsers.expat
 
-from pygments import highlight
-from pygments.lexers import get_lexer_by_name
-from pygments.formatters import HtmlFormatter
+from xml2xhtml_socket import defaultSocketPath, prepareSocket
 
-import latex2mathml.converter as MathConv
-#MathConv.COMMANDS['\\sfrac'] = (2, 'mfrac', {'bevelled': 'true'})
+# pygments and latex2mathml (and other modules not needed for most documents) are imported on first use,
+# see getLexer(), getFormatter(), getMathConverter(), so conversion of document without <m> and <insertSourceCode>
+# (or with all of them found in cache) don't pay for its import
 
-# command line arguments
-if len(sys.argv) != 3 or sys.argv[1] == "--help" or sys.argv[1] == "-h":
-	print("USAGE:", sys.argv[0], "inputFile outputFile", file=sys.stderr)
-	exit(1)
-
-inputFile = sys.stdin
-inputPath = os.getcwd() + "/"
-if sys.argv[1] != '-':
-	inputFile = open(sys.argv[1], "r")
-	inputPath = os.path.dirname(os.path.realpath(sys.argv[1])) + "/"
-
-outputFile = sys.stdout
-if sys.argv[2] != '-':
-	outputFile = open(sys.argv[2], "w")
-
-
-# regexp for split namespace and tag name
-tagSplitRegex = re.compile("[{}]")
-
-# main parsing function
-def parseDoc(element, level):
-	tag      = tagSplitRegex.split(element.tag)
-	tagName  = tag[-1]
+# convert single element (without childs, except of <m>, <insertSourceCode> content)
+# doc is dict with state of converted document: 'path' (directory for <insertSourceCode> files),
+# 'files' (list of read <insertSourceCode> files) and other (see scanDoc())
+def transformElement(element, doc):
+	tagName = element.tag.rpartition("}")[2]
 	
 	if tagName == 'section':
-		level = addToTOC(element, level)
+		profileCount('section')
+		idVal = next(doc['sectionIds'])
+		if idVal is not None:
+			element.attrib['id'] = idVal
 		element.tag = "{" + defaultNameSpace + "}" + "div"
 		addClass(element, "section")
 	elif tagName == 'p':
 		element.tag = "{" + defaultNameSpace + "}" + "div"
 		addClass(element, "par")
 	elif tagName == 'm':
+		profileCount('m')
 		element.tag = "{" + defaultNameSpace + "}" + "span"
 		#addClass(element, "math")
 		addMathML(element)
 	elif tagName == 'insertSourceCode':
+		profileCount('insertSourceCode')
 		element.tag = "{" + defaultNameSpace + "}" + "pre"
-		addSourceCode(element)
-	
-	for e in element:
-		parseDoc(e, level)
+		doc['files'].append(addSourceCode(element, doc['path']))
+
+# convert element and all its childs (in document order, without recursion)
+def transformTree(element, doc):
+	stack = [element]
+	while stack:
+		element = stack.pop()
+		transformElement(element, doc)
+		stack.extend(reversed(element))
+
+
+# profiling of conversion (--profile) -- when profile is dict (not None) it collects for actually converted document:
+#  * 'times' -- phase name -> seconds (without time of nested phases, see profileBegin() and profileEnd())
+#  * 'counts' -- counter name -> number (converted elements, cache hits and misses, converted equations and codes)
+#  * 'slowest' -- kind ('mathml' or 'highlight') -> {item (LaTeX equation or source code file path) -> seconds}
+# profile is created (for each document) by convertFile() when profileFile is set and appended to it by writeProfile()
+profileFile = None
+profile = None
+
+def profileBegin():
+	if profile is not None:
+		profile['stack'].append([time.perf_counter(), 0.0])  # [start time, time of nested phases]
+
+def profileEnd(phase):
+	if profile is not None:
+		start, nested = profile['stack'].pop()
+		t = time.perf_counter() - start
+		profile['times'][phase] = profile['times'].get(phase, 0.0) + t - nested
+		if profile['stack']:
+			profile['stack'][-1][1] += t
+
+def profileCount(name, n=1):
+	if profile is not None:
+		profile['counts'][name] = profile['counts'].get(name, 0) + n
+
+# return start time for profileElapsed() or None when profile is disabled
+def profileTime():
+	if profile is not None:
+		return [time.perf_counter(), profile['times'].get('import', 0.0)]
+
+# return time from startTime (got from profileTime()) without time of modules import
+def profileElapsed(startTime):
+	return time.perf_counter() - startTime[0] - (profile['times'].get('import', 0.0) - startTime[1])
 
+def profileItem(kind, item, seconds):
+	if profile is not None:
+		items = profile['slowest'].setdefault(kind, {})
+		items[item] = max(items.get(item, 0.0), seconds)
 
 # add value to class list
 def addClass(element, value):
@@ -97,16 +135,121 @@ def addClass(element, value):
 		element.attrib["class"] = value
 
 
+# on disk cache (sqlite3 database in cacheDir, shared by all processes) for results of conversions
+# new entries and usage time of used entries are saved by cacheSave() (at end of each document),
+# least recently used entries are removed when size of cached values exceeds cacheMaxSize
+cacheDir = None
+cacheMaxSize = 64 << 20
+cacheDB = None     # [pid, sqlite3 connection] -- connection can't be shared with forked worker processes
+cacheNew = {}      # key -> value of entries not saved yet
+cacheUsed = set()  # keys of entries got from database
+
+def cacheConnect():
+	global cacheDB
+	if cacheDB is None or cacheDB[0] != os.getpid():
+		import sqlite3
+		os.makedirs(cacheDir, exist_ok=True)
+		conn = sqlite3.connect(os.path.join(cacheDir, "cache.sqlite"), timeout=60)
+		conn.execute("PRAGMA journal_mode=WAL")
+		conn.execute("CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value TEXT, size INT, used REAL)")
+		cacheDB = [os.getpid(), conn]
+	return cacheDB[1]
+
+# return cached value for key or None (when not found or cache is disabled)
+def cacheGet(key):
+	if not cacheDir:
+		return None
+	profileBegin()
+	row = cacheConnect().execute("SELECT value FROM cache WHERE key = ?", (key,)).fetchone()
+	profileEnd('cache')
+	kind = key.split(":", 1)[0]
+	if row is None:
+		profileCount(kind + ".diskMisses")
+		return None
+	profileCount(kind + ".diskHits")
+	cacheUsed.add(key)
+	return row[0]
+
+def cachePut(key, value):
+	if cacheDir:
+		cacheNew[key] = value
+
+def cacheSave():
+	if not cacheNew and not cacheUsed:
+		return
+	profileBegin()
+	conn, now = cacheConnect(), time.time()
+	with conn:
+		conn.executemany("INSERT OR REPLACE INTO cache VALUES (?, ?, ?, ?)", ((k, v, len(v), now) for k, v in cacheNew.items()))
+		conn.executemany("UPDATE cache SET used = ? WHERE key = ?", ((now, k) for k in cacheUsed))
+		if conn.execute("SELECT SUM(size) FROM cache").fetchone()[0] > cacheMaxSize:
+			# keep most recently used entries up to 90% of cacheMaxSize
+			conn.execute(
+				"DELETE FROM cache WHERE key IN (SELECT key FROM"
+				" (SELECT key, SUM(size) OVER (ORDER BY used DESC, key) AS total FROM cache) WHERE total > ?)",
+				(cacheMaxSize * 0.9,)
+			)
+	cacheNew.clear()
+	cacheUsed.clear()
+	profileEnd('cache')
+
+
 # convert latex to mathml
 def addMathML(element):
+	startTime = profileTime()
 	element.attrib['title'] = "LaTeX: " + element.text
-	mathML = MathConv.convert(element.text)
-	mathML = xmlParser.fromstring(mathML)
-	mathML.attrib['xmlns'] = "http://www.w3.org/1998/Math/MathML"
-	# reparse to add namespace prefix for mathML childs ...
-	mathML = xmlParser.fromstring(xmlParser.tostring(mathML))
 	element.text = ""
-	element.append(mathML)
+	element.append(copy.deepcopy(latexToMathML(element.attrib['title'][7:])))
+	if startTime is not None:
+		profileItem('mathml', element.attrib['title'][7:], profileElapsed(startTime))
+
+# return MathML element (with namespace) for LaTeX equation -- shared by all calls for the same equation, so must be copied
+@functools.lru_cache(maxsize=4096)
+def latexToMathML(latex):
+	profileBegin()
+	key = mathMLKey(latex)
+	mathML = rendered.get(key) or cacheGet(key)
+	if mathML is None:
+		profileCount("mathml.converted")
+		mathML = mathMLString(latex)
+		cachePut(key, mathML)
+	mathML = xmlParser.fromstring(mathML)
+	profileEnd('mathml')
+	return mathML
+
+def mathMLKey(latex):
+	return "mathml:" + hashlib.sha1((mathMLVersion() + "\0" + latex).encode()).hexdigest()
+
+# return MathML (as string) for LaTeX equation
+def mathMLString(latex):
+	mathML = getMathConverter().convert(latex)
+	# add namespace declaration (not added by older latex2mathml versions) for prefix of mathML childs in output
+	if "xmlns=" not in mathML.split(">", 1)[0]:
+		mathML = mathML.replace("<math", '<math xmlns="http://www.w3.org/1998/Math/MathML"', 1)
+	return mathML
+
+@functools.lru_cache(maxsize=None)
+def getMathConverter():
+	profileBegin()
+	import latex2mathml.converter as MathConv
+	profileEnd('import')
+	#MathConv.COMMANDS['\\sfrac'] = (2, 'mfrac', {'bevelled': 'true'})
+	return MathConv
+
+# version of equations conversion (for cache keys) -- hash of latex2mathml source files
+# (without import of latex2mathml, because it is slow and not needed when all equations are in cache)
+@functools.lru_cache(maxsize=None)
+def mathMLVersion():
+	import importlib.util
+	h = hashlib.sha1(b"1")
+	spec = importlib.util.find_spec("latex2mathml")
+	if spec and spec.submodule_search_locations:
+		for path in spec.submodule_search_locations:
+			for name in sorted(os.listdir(path)):
+				if os.path.isfile(os.path.join(path, name)):
+					with open(os.path.join(path, name), "rb") as f:
+						h.update(f.read())
+	return h.hexdigest()
 
 # map filename_extention -> [pygments_lexer_name, display_name]
 extMap = {
@@ -120,111 +263,782 @@ extMap = {
 	"xml": ["xml", "XHTML+JavaScript"],
 }
 
-# add source code from external file and prepare highlight
-def addSourceCode(element, filePath=inputPath, useHighlight=True):
+# add source code from external file and prepare highlight, return path of source code file
+def addSourceCode(element, filePath, useHighlight=True):
+	startTime = profileTime()
 	filename = element.attrib["file"]
-	if "type" in element.attrib:
-		orgExt = element.attrib["type"]
-	else:
-		orgExt = filename.rsplit(".",1)[1]
-	
-	ext = extMap.get(orgExt, [orgExt, None])[0]
+	orgExt, ext = sourceCodeType(element.attrib)
 	
 	srcFile = open(filePath + filename)
 	srcTxt = srcFile.read()
 	srcFile.close()
 	
 	if useHighlight:
-		srcTxt = highlight(srcTxt, get_lexer_by_name(ext), HtmlFormatter(nowrap=True))
-	
-	if srcTxt[0] != '\n':
-		srcTxt = '\n' + srcTxt
-	if srcTxt[-1] != '\n':
-		srcTxt = srcTxt + '\n'
-	
-	if useHighlight:
-		srcHtml = xmlParser.fromstring("<pre>" + srcTxt + "</pre>")
+		srcHtml = highlightCode(srcTxt, ext)
 		tail = element.tail
 		element.clear()
 		element.text = srcHtml.text
 		element.tail = tail
 		for ee in srcHtml:
-			element.append(ee)
+			element.append(copy.deepcopy(ee))
 	else:
-		element.text = srcTxt
+		element.text = addNewLines(srcTxt)
 	
 	element.attrib.clear()
 	element.attrib['class'] = ext + " pygments"
 	element.attrib['data-title'] = extMap.get(orgExt, [None, ext])[1]
+	if startTime is not None:
+		profileItem('highlight', filePath + filename, profileElapsed(startTime))
+	return filePath + filename
+
+# return type of source code (from type attribute or file name extension) and pygments lexer name for <insertSourceCode> attributes
+def sourceCodeType(attrib):
+	if "type" in attrib:
+		orgExt = attrib["type"]
+	else:
+		orgExt = attrib["file"].rsplit(".",1)[1]
+	return orgExt, extMap.get(orgExt, [orgExt, None])[0]
+
+# add new line at begin and end of source code (if not exist)
+def addNewLines(srcTxt):
+	if srcTxt[0] != '\n':
+		srcTxt = '\n' + srcTxt
+	if srcTxt[-1] != '\n':
+		srcTxt = srcTxt + '\n'
+	return srcTxt
+
+# return <pre> element with source code highlighted by pygments lexer lexerName
+# shared by all calls for the same code, so childs must be copied
+@functools.lru_cache(maxsize=256)
+def highlightCode(srcTxt, lexerName):
+	profileBegin()
+	key = highlightKey(srcTxt, lexerName)
+	srcHtml = rendered.get(key) or cacheGet(key)
+	if srcHtml is None:
+		profileCount("highlight.converted")
+		srcHtml = highlightString(srcTxt, lexerName)
+		cachePut(key, srcHtml)
+	srcHtml = xmlParser.fromstring("<pre>" + srcHtml + "</pre>")
+	profileEnd('highlight')
+	return srcHtml
+
+def highlightKey(srcTxt, lexerName):
+	import pygments
+	return "highlight:" + hashlib.sha1(("1:pygments-" + pygments.__version__ + "\0" + lexerName + "\0" + srcTxt).encode()).hexdigest()
+
+# return highlighted source code (as string with pygments <span> elements)
+def highlightString(srcTxt, lexerName):
+	import pygments
+	return addNewLines(pygments.highlight(srcTxt, getLexer(lexerName), getFormatter()))
+
+# lexer and formatter objects are reused for all highlighted codes
+@functools.lru_cache(maxsize=None)
+def getLexer(lexerName):
+	profileBegin()
+	from pygments.lexers import get_lexer_by_name
+	lexer = get_lexer_by_name(lexerName)
+	profileEnd('import')
+	return lexer
+
+@functools.lru_cache(maxsize=None)
+def getFormatter():
+	profileBegin()
+	from pygments.formatters import HtmlFormatter
+	formatter = HtmlFormatter(nowrap=True)
+	profileEnd('import')
+	return formatter
+
+
+# parallel conversion of equations and source codes -- between scanDoc() and writeDoc() all unique (and not cached)
+# equations and source codes from document are converted in renderJobs worker processes, results are stored
+# in rendered dict (key as for cache -> value) used by latexToMathML() and highlightCode() in writeDoc()
+renderJobs = 1         # number of worker processes (0 = number of CPUs, 1 = convert in writeDoc() without worker processes)
+renderMinJobs = 32     # minimal number of not cached equations and source codes to use worker processes
+renderPool = None
+rendered = {}
+
+def renderDoc(doc):
+	workers = renderJobs or os.cpu_count() or 1
+	if workers == 1:
+		return
+	
+	jobs = {}  # key (as for cache) -> [function, arguments, item for profile] for unique equations and source codes
+	for latex in doc['mathJobs']:
+		jobs[mathMLKey(latex)] = [mathMLString, (latex,), latex]
+	for path, lexerName in doc['codeJobs']:
+		try:
+			with open(path) as srcFile:
+				srcTxt = srcFile.read()
+		except (OSError, UnicodeDecodeError):
+			continue  # error is reported by addSourceCode() in writeDoc()
+		jobs[highlightKey(srcTxt, lexerName)] = [highlightString, (srcTxt, lexerName), path]
+	
+	for key in list(jobs):
+		value = cacheGet(key)
+		if value is not None:
+			rendered[key] = value
+			del jobs[key]
+	if len(jobs) < renderMinJobs:
+		return
+	
+	global renderPool
+	if renderPool is None:
+		from concurrent.futures import ProcessPoolExecutor
+		# import converter before creating (forked) workers, so each of them don't need import it again
+		if doc['mathJobs']:
+			getMathConverter()
+		renderPool = ProcessPoolExecutor(workers)
+	chunkSize = max(1, len(jobs) // (4 * workers))
+	for (key, job), (value, seconds) in zip(jobs.items(), renderPool.map(renderJob, jobs.values(), chunksize=chunkSize)):
+		if value is not None:
+			rendered[key] = value
+			cachePut(key, value)
+			kind = key.split(":", 1)[0]
+			profileCount(kind + ".rendered")
+			profileItem(kind, job[2], seconds)
+
+# run conversion in worker process, return [result, conversion time]
+# (result is None on error, so error is raised in writeDoc() for element in document)
+def renderJob(job):
+	function, args, item = job
+	startTime = time.perf_counter()
+	try:
+		return [function(*args), time.perf_counter() - startTime]
+	except Exception:
+		return [None, 0.0]
 
 
 # prepare and generate Table Of Content
-toc = {}
+# toc is dict: id -> [title, level] (in document order)
 notInIdRegex = re.compile("[\"',()/+?]+")
-def addToTOC(element, level):
-	def getTitleNode(element):
-		for e in element:
-			if tagSplitRegex.split(e.tag)[-1] in ['h1', 'h2', 'h3', 'h4', 'h5']:
-				return e
-		return None
-	
-	title = getTitleNode(element)
-	if title != None:
-		if 'id' in element.attrib:
-			idVal = element.attrib['id']
-		else:
-			idVal = notInIdRegex.sub('', title.text.replace(" ", "_"))
-			element.attrib['id'] = idVal
-		if idVal in toc:
-			idValTmp = idVal
-			i = 0
-			while idVal in toc:
-				i += 1
-				idVal = idValTmp + "_" + str(i)
-			element.attrib['id'] = idVal
-		toc[idVal] = [title.text, level]
-		level += 1
-	return level
+titleTags = ('h1', 'h2', 'h3', 'h4', 'h5')
+pdfTitleTags = ('h2', 'h3', 'h4', 'h5')  # titles used by toc2pdf.py (see getTitle() in toc2pdf.py)
 
-def createTOC():
-	lastLevel = 0
-	tocTxt = ""
-	for idVal, [title, level] in toc.items():
-		while level <= lastLevel:
-			tocTxt += lastLevel * ' ' + '</ul></li>\n'
-			lastLevel -= 1
-		tocTxt += level * ' ' + '<li class="menu' + str(level) + '"><a href="#' + idVal + '">' + title + '</a><ul>\n'
-		lastLevel = level
-	while 1 <= lastLevel:
-		tocTxt += lastLevel * ' ' + '</ul></li>\n'
-		lastLevel -= 1
-	return re.sub('<ul>[\n\t ]*</ul>', '', tocTxt)
-
-def addTOC(element):
-	tocContent = xmlParser.fromstring("<toc>" + createTOC() + "</toc>")
-	tocNode = element.find(".//{" + defaultNameSpace + "}ul[@id='toc']")
+# add section with title (text) and id attribute (idVal, None when not set) to toc, return (unique) id of section
+# idCounters is dict: base id -> last used number suffix (so adding many sections with the same title is linear)
+def addToTOC(toc, idCounters, idVal, title, level):
+	if idVal is None:
+		idVal = notInIdRegex.sub('', title.replace(" ", "_"))
+	if idVal in toc:
+		idValTmp = idVal
+		i = idCounters.get(idValTmp, 0)
+		while idVal in toc:
+			i += 1
+			idVal = idValTmp + "_" + str(i)
+		idCounters[idValTmp] = i
+	toc[idVal] = [title, level]
+	return idVal
+
+# replace content of tocNode (<ul id="toc">) by table of content -- nested <li><a href="#id">title</a><ul>...</ul></li> lists
+# (indented by spaces by nesting level)
+def addTOC(tocNode, toc):
 	tail = tocNode.tail
 	tocNode.clear()
-	tocNode.text = tocContent.text
 	tocNode.tail = tail
-	for ee in tocContent:
-		tocNode.append(ee)
 	tocNode.attrib['id'] = 'toc'
+	if toc:
+		tocNode.text = " "
+	
+	lists = [tocNode]  # lists[level-1] is <ul> for items with level
+	for idVal, [title, level] in toc.items():
+		if level > len(lists):
+			ul = xmlParser.SubElement(lists[-1][-1], "ul")
+			ul.text = "\n" + level * " "
+			lists.append(ul)
+		del lists[level:]
+		ul = lists[-1]
+		if len(ul):
+			ul[-1].tail = "\n" + level * " "
+		li = xmlParser.SubElement(ul, "li", {"class": "menu" + str(level)})
+		li.tail = "\n" + (level - 1) * " "
+		xmlParser.SubElement(li, "a", {"href": "#" + idVal}).text = title
 
+# write table of content for PDF to JSON file (for toc2pdf.py): list of {"title", "level"} objects
+# headings is list of [title, level] (see scanDoc())
+def writeTOCFile(path, headings):
+	with open(path, "w") as f:
+		json.dump(
+			[{"title": title, "level": level} for title, level in headings],
+			f, ensure_ascii=False, separators=(',', ':')
+		)
 
-# open and parse xml file
+
+# namespaces for output documents
+# (prefixes as registered in xml.etree.ElementTree, other namespaces get ns0, ns1, ... prefixes)
 defaultNameSpace = 'http://www.w3.org/1999/xhtml'
-xmlParser.register_namespace('', defaultNameSpace)
-xmlParser.register_namespace('svg', 'http://www.w3.org/2000/svg')
-xmlParser.register_namespace('m', 'http://www.w3.org/1998/Math/MathML')
+mathNameSpace    = 'http://www.w3.org/1998/Math/MathML'
+xmlNameSpace     = 'http://www.w3.org/XML/1998/namespace'
+nameSpacePrefixes = {defaultNameSpace: '', 'http://www.w3.org/2000/svg': 'svg', mathNameSpace: 'm'}
+for uri, prefix in nameSpacePrefixes.items():
+	xmlParser.register_namespace(prefix, uri)
+
+# return True for <ul id="toc"> element
+def isTOCNode(element):
+	return element.tag == "{" + defaultNameSpace + "}ul" and element.attrib.get('id') == 'toc'
+
+# first pass of conversion -- read inputFile (by expat, without building elements) and add to doc:
+#  * 'toc' -- table of content (see addToTOC())
+#  * 'sectionIds' -- iterator over ids for all converted <section> elements (None for section without title)
+#  * 'headings' -- [title, level] for all titles in output document as found by toc2pdf.py in XHTML (in the same order):
+#    element is titled by text of its first <h2>-<h5> child (when not empty), level is number of titled parents + 1
+#  * 'nameSpaces' -- dict namespace -> prefix for all namespaces in output document (in order of first usage)
+#  * 'mathJobs' -- unique LaTeX equations from <m> elements, 'codeJobs' -- unique (path, lexer name) from <insertSourceCode>
+# (see transformElement() and writeDoc() -- this must follow the same rules)
+def scanDoc(inputFile, doc):
+	parser = xml.parsers.expat.ParserCreate(namespace_separator="}")
+	parser.buffer_text = True
+	
+	sections   = []    # [id attribute, title text fragments, parent section index] for all converted <section> elements
+	nameSpaces = {}
+	stack      = []    # [local name, section index (for <section>) or None, title is found, heading node or None] for open elements
+	headings   = [None, [], False]  # tree of titled elements for 'headings', node (created only when needed) is:
+	                                # [title text fragments, titled child nodes, <h2>-<h5> child is found]
+	heading    = None  # text fragments of actually read <h2>-<h5> title (before its first child)
+	sectionStack = []  # indexes of open sections
+	skipDepth  = None  # depth of element with ignored content -- <insertSourceCode>
+	skipNSDepth = None # depth of element with content not used for namespaces -- <ul id="toc">
+	tocFound   = False
+	title      = None  # text fragments of actually read title (before its first child)
+	mathTexts  = []    # text fragments of all <m> elements
+	math       = None  # text fragments of actually read <m> element (before its first child)
+	codeJobs   = {}
+	
+	# name is in expat format: "namespace}localName" or "localName"
+	def addNameSpace(name):
+		if "}" in name:
+			uri = name.split("}", 1)[0]
+			if uri not in nameSpaces and uri != xmlNameSpace:
+				nameSpaces[uri] = nameSpacePrefixes.get(uri, "ns%d" % len(nameSpaces))
+	
+	def startElement(name, attrs):
+		nonlocal skipDepth, skipNSDepth, tocFound, title, heading, math
+		title, heading, math = None, None, None
+		if skipDepth is not None:
+			stack.append(None)
+			return
+		
+		tagName = name.rpartition("}")[2]
+		sectionIndex = None
+		if stack and stack[-1][1] is not None and not stack[-1][2] and tagName in titleTags:
+			title = sections[stack[-1][1]][1] = []
+			stack[-1][2] = True
+		if stack and tagName in pdfTitleTags:
+			node = stack[-1][3] = stack[-1][3] or [None, [], False]
+			if not node[2]:
+				node[2] = True
+				if skipNSDepth is None:  # content of <ul id="toc"> is replaced in output
+					heading = node[0] = []
+		if tagName == 'section':
+			sectionIndex = len(sections)
+			sections.append([attrs.get('id'), None, sectionStack[-1] if sectionStack else None])
+			sectionStack.append(sectionIndex)
+		
+		if skipNSDepth is None:
+			addNameSpace(defaultNameSpace + "}" if tagName in ('section', 'p', 'm', 'insertSourceCode') else name)
+			if tagName == 'insertSourceCode':
+				pass  # attributes are replaced
+			elif not tocFound and name == defaultNameSpace + "}ul" and attrs.get('id') == 'toc':
+				tocFound = True
+				skipNSDepth = len(stack)
+			else:
+				for attrName in attrs:
+					addNameSpace(attrName)
+		if tagName == 'insertSourceCode':
+			skipDepth = len(stack)
+			if "file" in attrs:
+				codeJobs[(doc['path'] + attrs["file"], sourceCodeType(attrs)[1])] = True
+		elif tagName == 'm':
+			math = []
+			mathTexts.append(math)
+		stack.append([tagName, sectionIndex, False, None])
+	
+	def endElement(name):
+		nonlocal skipDepth, skipNSDepth, title, heading, math
+		title, heading, math = None, None, None
+		element = stack.pop()
+		if element is None:
+			return
+		# keep only titled elements in headings tree (children of not titled element are moved to its parent)
+		node = element[3]
+		if node and (node[0] or node[1]):
+			if stack:
+				parentNode = stack[-1][3] = stack[-1][3] or [None, [], False]
+			else:
+				parentNode = headings
+			if node[0]:
+				parentNode[1].append(node)
+			else:
+				parentNode[1].extend(node[1])
+		if len(stack) == skipDepth:
+			skipDepth = None
+		elif len(stack) == skipNSDepth:
+			skipNSDepth = None
+		elif skipNSDepth is None and element[0] == 'm':
+			addNameSpace(mathNameSpace + "}")
+		if element[1] is not None:
+			sectionStack.pop()
+	
+	def characterData(data):
+		if title is not None:
+			title.append(data)
+		if heading is not None:
+			heading.append(data)
+		if math is not None:
+			math.append(data)
+	
+	parser.StartElementHandler  = startElement
+	parser.EndElementHandler    = endElement
+	parser.CharacterDataHandler = characterData
+	while True:
+		data = inputFile.read(1 << 16)
+		if not data:
+			break
+		parser.Parse(data, False)
+	parser.Parse("", True)
+	
+	if not tocFound:
+		raise ValueError("<ul id=\"toc\"> not found")
+	
+	profileBegin()
+	toc, idCounters, ids, childLevels = {}, {}, [], []
+	for idVal, title, parent in sections:
+		level = 1 if parent is None else childLevels[parent]
+		if title is None:
+			ids.append(None)
+			childLevels.append(level)
+		else:
+			ids.append(addToTOC(toc, idCounters, idVal, ''.join(title) if title else None, level))
+			childLevels.append(level + 1)
+	
+	# headings tree in pre-order (parent before its children)
+	doc['headings'], nodes = [], [[node, 1] for node in reversed(headings[1])]
+	while nodes:
+		node, level = nodes.pop()
+		doc['headings'].append([''.join(node[0]), level])
+		nodes.extend([child, level + 1] for child in reversed(node[1]))
+	profileEnd('toc')
+	doc['toc'], doc['sectionIds'], doc['nameSpaces'] = toc, iter(ids), nameSpaces
+	doc['mathJobs'], doc['codeJobs'] = dict.fromkeys(''.join(m) for m in mathTexts if m), list(codeJobs)
+
+# second pass of conversion -- read inputFile again, convert and write output by write function
+# elements are written as soon as possible and removed from memory (except of <m>, <insertSourceCode>
+# and <ul id="toc"> elements, which are converted and written with its content on its end)
+# output is the same as xml.etree.ElementTree.tostring() for whole converted document
+def writeDoc(inputFile, write, doc):
+	nameSpaces = doc['nameSpaces']
+	qnames = {}
+	def qname(name):
+		if name not in qnames:
+			if name[:1] == "{":
+				uri, localName = name[1:].split("}", 1)
+				prefix = "xml" if uri == xmlNameSpace else nameSpaces[uri]
+				qnames[name] = prefix + ":" + localName if prefix else localName
+			else:
+				qnames[name] = name
+		return qnames[name]
+	
+	def startTag(element, tag, isRoot=False):
+		txt = "<" + tag
+		if isRoot:
+			for uri, prefix in sorted(nameSpaces.items(), key=lambda x: x[1]):
+				txt += ' xmlns' + (':' + prefix if prefix else '') + '="' + escapeAttrib(uri) + '"'
+		for name, value in element.attrib.items():
+			txt += ' ' + qname(name) + '="' + escapeAttrib(value) + '"'
+		return txt
+	
+	# write element with all childs (but without tail)
+	def writeTree(root):
+		stack = [root]
+		while stack:
+			element = stack.pop()
+			if isinstance(element, str):
+				write(element)
+				continue
+			tag = qname(element.tag)
+			tail = escapeCData(element.tail) if element.tail and element is not root else ""
+			if element.text or len(element):
+				write(startTag(element, tag) + ">" + escapeCData(element.text or ""))
+				stack.append("</" + tag + ">" + tail)
+				stack.extend(reversed(element))
+			else:
+				write(startTag(element, tag) + " />" + tail)
+	
+	stack    = []    # [element, start tag is written, last child (with not written tail)] for open elements
+	buffered = None  # element converted and written (with all its content) on its end
+	tocFound = False
+	for event, element in xmlParser.iterparse(inputFile, ("start", "end")):
+		if buffered is not None and element is not buffered:
+			continue
+		
+		if event == "start":
+			if stack:
+				parent = stack[-1]
+				if not parent[1]:
+					write(startTag(parent[0], qname(parent[0].tag), len(stack) == 1) + ">" + escapeCData(parent[0].text or ""))
+					parent[1] = True
+				elif parent[2] is not None and parent[2].tail:
+					write(escapeCData(parent[2].tail))
+				parent[2] = None
+			
+			if element.tag.rpartition("}")[2] in ('m', 'insertSourceCode') or (not tocFound and isTOCNode(element)):
+				buffered = element
+			else:
+				transformElement(element, doc)
+				stack.append([element, False, None])
+			continue
+		
+		if element is buffered:
+			buffered = None
+			transformTree(element, doc)
+			if not tocFound and isTOCNode(element):
+				tocFound = True
+				profileBegin()
+				addTOC(element, doc['toc'])
+				profileEnd('toc')
+			writeTree(element)
+		else:
+			element, opened, lastChild = stack.pop()
+			tag = qname(element.tag)
+			if opened:
+				if lastChild is not None and lastChild.tail:
+					write(escapeCData(lastChild.tail))
+				write("</" + tag + ">")
+			elif element.text:
+				write(startTag(element, tag, not stack) + ">" + escapeCData(element.text) + "</" + tag + ">")
+			else:
+				write(startTag(element, tag, not stack) + " />")
+		
+		if stack:
+			# free memory -- remove written element (tail is written on next event from its parent)
+			stack[-1][2] = element
+			stack[-1][0].remove(element)
+
+# escape text and attribute values for XML output (as xml.etree.ElementTree serializer)
+def escapeCData(text):
+	if "&" in text:
+		text = text.replace("&", "&amp;")
+	if "<" in text:
+		text = text.replace("<", "&lt;")
+	if ">" in text:
+		text = text.replace(">", "&gt;")
+	return text
 
-xml = xmlParser.ElementTree()
-rootNode = xml.parse( inputFile )
+def escapeAttrib(text):
+	text = escapeCData(text)
+	if "\"" in text:
+		text = text.replace("\"", "&quot;")
+	if "\r" in text:
+		text = text.replace("\r", "&#13;")
+	if "\n" in text:
+		text = text.replace("\n", "&#10;")
+	if "\t" in text:
+		text = text.replace("\t", "&#09;")
+	return text
+
+# convert xml document from inputFile and write XHTML to outputFile (file objects)
+# basePath is directory (with trailing slash) for relative paths of <insertSourceCode> files
+# document is read twice (first to get table of content), so not seekable input is copied to temporary file
+# return doc dict with 'files' (paths of all files included in document) and 'toc' (see addToTOC())
+# state of document is kept only in doc, so convert() can be called many times in one process (but not in parallel threads),
+# module level variables are only configuration (cacheDir, cacheMaxSize, renderJobs) and caches shared by documents
+def convert(inputFile, outputFile, basePath):
+	if not inputFile.seekable():
+		tmpFile = tempfile.SpooledTemporaryFile(1 << 24, "w+")
+		shutil.copyfileobj(inputFile, tmpFile)
+		inputFile = tmpFile
+		inputFile.seek(0)
+	
+	doc = {'path': basePath, 'files': []}
+	profileBegin()
+	scanDoc(inputFile, doc)
+	profileEnd('scan')
+	inputFile.seek(0)
+	
+	try:
+		profileBegin()
+		renderDoc(doc)
+		profileEnd('render')
+		profileBegin()
+		outputFile.write('<?xml version="1.0" encoding="UTF-8" ?>\n')
+		writeDoc(inputFile, outputFile.write, doc)
+		profileEnd('write')
+	finally:
+		rendered.clear()
+	cacheSave()
+	return doc
+
+# convert inputPath to outputPath ('-' for stdin / stdout), on error remove (incomplete) output file and raise exception
+# when depFile is True write make rules with dependencies of outputPath to outputPath + ".d"
+# when tocFile is True write table of content to outputPath + ".toc.json"
+def convertFile(inputPath, outputPath, depFile=False, tocFile=False):
+	global profile
+	if profileFile:
+		profile = {'times': {}, 'counts': {}, 'slowest': {}, 'stack': []}
+		startTime, mathMLHits, highlightHits = time.perf_counter(), latexToMathML.cache_info().hits, highlightCode.cache_info().hits
+	
+	inputFile, basePath = sys.stdin, os.getcwd() + "/"
+	if inputPath != '-':
+		inputFile, basePath = open(inputPath, "r"), os.path.dirname(os.path.realpath(inputPath)) + "/"
+	
+	outputFile = sys.stdout
+	if outputPath != '-':
+		outputFile = open(outputPath, "w")
+	
+	try:
+		try:
+			doc = convert(inputFile, outputFile, basePath)
+		finally:
+			# close only files opened here (stdin / stdout can be used by next pair of files)
+			if inputFile is not sys.stdin:
+				inputFile.close()
+			if outputFile is not sys.stdout:
+				outputFile.close()
+			else:
+				outputFile.flush()
+	except BaseException:
+		profile = None
+		if outputPath != '-':
+			os.remove(outputPath)
+		raise
+	
+	if depFile and outputPath != '-':
+		writeDepFile(outputPath + ".d", outputPath, ([inputPath] if inputPath != '-' else []) + list(dict.fromkeys(doc['files'])))
+	if tocFile and outputPath != '-':
+		profileBegin()
+		writeTOCFile(outputPath + ".toc.json", doc['headings'])
+		profileEnd('toc')
+	
+	if profile is not None:
+		profileCount("mathml.memoryHits", latexToMathML.cache_info().hits - mathMLHits)
+		profileCount("highlight.memoryHits", highlightCode.cache_info().hits - highlightHits)
+		writeProfile(profileFile, inputPath, outputPath, time.perf_counter() - startTime)
+		profile = None
+
+# append profile of document as single line of JSON to file path:
+# {"input", "output", "total" (seconds), "times", "counts", "slowest" (10 slowest items of each kind as [seconds, item])}
+# (line is written by single write() on file opened with O_APPEND, so many processes can write to the same file)
+def writeProfile(path, inputPath, outputPath, total):
+	times = profile['times']
+	times['other'] = total - sum(times.values())
+	report = {
+		'input': inputPath, 'output': outputPath, 'total': total, 'times': times, 'counts': profile['counts'],
+		'slowest': {kind: sorted(([t, item] for item, t in items.items()), reverse=True)[:10] for kind, items in profile['slowest'].items()}
+	}
+	fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+	try:
+		os.write(fd, (json.dumps(report, ensure_ascii=False) + "\n").encode())
+	finally:
+		os.close(fd)
+
+# return summary of profiles from files (lines written by writeProfile(), e.g. for all pages of site build):
+# number of documents, sum of total times, times of phases and counters, 20 slowest documents and items of each kind
+def profileSummary(paths):
+	summary = {'documents': 0, 'total': 0.0, 'times': {}, 'counts': {}, 'slowestDocuments': [], 'slowest': {}}
+	slowest = {}  # kind -> {item -> seconds}
+	for path in paths:
+		with open(path) as f:
+			for line in f:
+				report = json.loads(line)
+				summary['documents'] += 1
+				summary['total'] += report['total']
+				for name, t in report['times'].items():
+					summary['times'][name] = summary['times'].get(name, 0.0) + t
+				for name, n in report['counts'].items():
+					summary['counts'][name] = summary['counts'].get(name, 0) + n
+				summary['slowestDocuments'].append([report['total'], report['input']])
+				for kind, items in report['slowest'].items():
+					kindItems = slowest.setdefault(kind, {})
+					for t, item in items:
+						kindItems[item] = max(kindItems.get(item, 0.0), t)
+	summary['slowestDocuments'] = sorted(summary['slowestDocuments'], reverse=True)[:20]
+	for kind, items in slowest.items():
+		summary['slowest'][kind] = sorted(([t, item] for item, t in items.items()), reverse=True)[:20]
+	return summary
+
+# write make rules: target depends on all deps and empty rules for deps (as `gcc -MP`, so removed file don't break make)
+def writeDepFile(path, target, deps):
+	def escape(path):
+		return path.replace("$", "$$").replace("#", "\\#").replace(" ", "\\ ")
+	with open(path, "w") as f:
+		f.write(escape(target) + ":" + "".join(" \\\n " + escape(dep) for dep in deps) + "\n")
+		for dep in deps[1:]:
+			f.write("\n" + escape(dep) + ":\n")
+
+# convertFile() for (inputPath, outputPath) pair, return error message or None (for batch mode)
+def tryConvertFile(paths, depFile=False, tocFile=False):
+	try:
+		convertFile(*paths, depFile, tocFile)
+	except Exception as e:
+		return paths[0] + ": " + type(e).__name__ + ": " + str(e)
+
+
+# conversion server -- listen on unix socket (socketPath) for requests from xml2xhtml_client.py and run each of them
+# (main() with client arguments in client working directory) in forked process, so conversion of page don't pay for
+# interpreter startup and modules import (requests from `make -j` are converted in parallel)
+# server exits after idleTimeout seconds without requests (0 = never)
+def serve(socketPath, idleTimeout):
+	import socket, select, signal
+	
+	error = prepareSocket(socketPath)
+	if error:
+		print(error, file=sys.stderr)
+		return 1
+	with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+		try:
+			client.connect(socketPath)
+			print("Server is already running on " + socketPath, file=sys.stderr)
+			return 1
+		except OSError:
+			if os.path.lexists(socketPath):
+				os.remove(socketPath)  # stale socket of not running server (owned by user, see prepareSocket())
+	server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+	server.bind(socketPath)
+	server.listen(64)
+	
+	# import modules and prepare converters before fork, so requests processes get them ready
+	try:
+		getMathConverter()
+		mathMLVersion()
+		getFormatter()
+		for lexerName, displayName in extMap.values():
+			getLexer(lexerName)
+	except ImportError:
+		pass  # error is reported for documents which need it
+	
+	# remove socket also on SIGTERM
+	signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+	
+	children, lastRequest = set(), time.time()
+	try:
+		while True:
+			ready = select.select([server], [], [], 1 if children or idleTimeout else None)[0]
+			while children:
+				pid, status = os.waitpid(-1, os.WNOHANG)
+				if pid == 0:
+					break
+				children.discard(pid)
+			if ready:
+				conn, addr = server.accept()
+				pid = os.fork()
+				if pid == 0:
+					server.close()
+					try:
+						handleRequest(conn)
+					finally:
+						os._exit(0)
+				conn.close()
+				children.add(pid)
+				lastRequest = time.time()
+			elif idleTimeout and not children and time.time() - lastRequest > idleTimeout:
+				break
+	except KeyboardInterrupt:
+		pass
+	finally:
+		server.close()
+		os.remove(socketPath)
+	return 0
+
+# run request -- JSON object with 'args' (list of command line arguments) and 'cwd' (working directory) read from conn
+# (to EOF) and send back JSON object with 'status' (exit status) and 'output' (messages printed by conversion)
+def handleRequest(conn):
+	import io
+	sys.stdout = sys.stderr = io.StringIO()
+	try:
+		request = json.load(conn.makefile("rb"))
+		os.chdir(request['cwd'])
+		status = main(request['args'], serverRequest=True)
+	except SystemExit as e:
+		status = e.code if isinstance(e.code, int) else 1
+	except Exception as e:
+		print("Can't process request: " + type(e).__name__ + ": " + str(e))
+		status = 1
+	conn.sendall(json.dumps({'status': status, 'output': sys.stderr.getvalue()}).encode())
+	conn.close()
+
+
+# run conversion for command line arguments argv (without program name), return exit status
+# (serverRequest is True when called by server for client request -- stdin / stdout and server options are not allowed)
+def main(argv, serverRequest=False):
+	global cacheDir, cacheMaxSize, renderJobs, renderPool, profileFile
+	
+	argParser = argparse.ArgumentParser(
+		description="convert xml files to XHTML, many files are converted in single process (without interpreter startup for each file)",
+		epilog="use '-' as inputFile / outputFile for stdin / stdout"
+	)
+	argParser.add_argument("files", nargs="*", metavar="inputFile outputFile",
+		help="pairs of input and output files (or with --dir: source and output directory)")
+	argParser.add_argument("-d", "--dir", action="store_true",
+		help="convert all .xml files from source directory to .xhtml files in output directory")
+	argParser.add_argument("--cache", metavar="DIR",
+		default=os.path.join(os.environ.get("XDG_CACHE_HOME", os.path.expanduser("~/.cache")), "textutils", "xml2xhtml"),
+		help="directory for on disk cache of converted equations and highlighted source codes (default: %(default)s)")
+	argParser.add_argument("--cache-size", type=int, default=64, metavar="MB",
+		help="limit of on disk cache size, least recently used entries are removed (default: %(default)s)")
+	argParser.add_argument("--no-cache", action="store_true",
+		help="don't use on disk cache")
+	argParser.add_argument("-M", "--depfile", action="store_true",
+		help="write make dependency file (outputFile.d) with inputFile and all included source code files")
+	argParser.add_argument("-t", "--toc-json", action="store_true",
+		help="write table of content for PDF (title and level of all <h2>-<h5> titles) to outputFile.toc.json (for toc2pdf.py)")
+	argParser.add_argument("-j", "--jobs", type=int, default=1, metavar="N",
+		help="convert files in N worker processes (default: %(default)s, 0 = number of CPUs)")
+	argParser.add_argument("-J", "--render-jobs", type=int, default=0, metavar="N",
+		help="convert equations and highlight source codes of single document in N worker processes"
+		     " (default: %(default)s = number of CPUs, used only when files are not converted in parallel by --jobs)")
+	argParser.add_argument("--profile", metavar="FILE",
+		help="append profile (times of conversion phases, counters, slowest equations and source codes) of each document"
+		     " as line of JSON to FILE")
+	argParser.add_argument("--profile-summary", action="store_true",
+		help="print summary (as JSON) of profiles from files given instead of inputFile outputFile pairs")
+	argParser.add_argument("--server", action="store_true",
+		help="run conversion server (for xml2xhtml_client.py) instead of converting files")
+	argParser.add_argument("--socket", default=defaultSocketPath(), metavar="PATH",
+		help="unix socket of conversion server (default: $XML2XHTML_SOCKET or %(default)s)")
+	argParser.add_argument("--idle-timeout", type=float, default=0, metavar="SECONDS",
+		help="exit server after SECONDS without requests (default: %(default)s = never)")
+	args = argParser.parse_args(argv)
+	
+	if args.server:
+		if serverRequest:
+			argParser.error("--server is not allowed in server request")
+		return serve(args.socket, args.idle_timeout)
+	if args.profile_summary:
+		print(json.dumps(profileSummary(args.files), indent="\t", ensure_ascii=False))
+		return 0
+	if not args.files or len(args.files) % 2:
+		argParser.error("need pairs of inputFile and outputFile")
+	if args.dir:
+		if len(args.files) != 2:
+			argParser.error("--dir need single pair of source and output directory")
+		srcDir, outDir = args.files
+		pairs = [
+			(os.path.join(srcDir, name), os.path.join(outDir, name[:-4] + ".xhtml"))
+			for name in sorted(os.listdir(srcDir)) if name.endswith(".xml")
+		]
+	else:
+		pairs = list(zip(args.files[0::2], args.files[1::2]))
+	if serverRequest and '-' in args.files:
+		argParser.error("stdin / stdout is not supported in server request")
+	
+	cacheDir, cacheMaxSize = None if args.no_cache else args.cache, args.cache_size << 20
+	profileFile = args.profile
+	
+	if args.jobs == 1 or len(pairs) == 1:
+		renderJobs = args.render_jobs
+		errors = list(map(functools.partial(tryConvertFile, depFile=args.depfile, tocFile=args.toc_json), pairs))
+		if renderPool:
+			renderPool.shutdown()
+			renderPool = None
+	else:
+		renderJobs = 1
+		from concurrent.futures import ProcessPoolExecutor
+		with ProcessPoolExecutor(args.jobs or os.cpu_count()) as pool:
+			errors = list(pool.map(functools.partial(tryConvertFile, depFile=args.depfile, tocFile=args.toc_json), pairs, chunksize=4))
+	errors = [e for e in errors if e]
+	for e in errors:
+		print("Can't convert " + e, file=sys.stderr)
+	return 1 if errors else 0
 
-# do parsing
-parseDoc(rootNode, 1)
-addTOC(rootNode)
 
-# write output xhtmlfile
-outputFile.write('<?xml version="1.0" encoding="UTF-8" ?>\n')
-outputFile.write(xmlParser.tostring(rootNode, encoding="unicode"))
+if __name__ == "__main__":
+	exit(main(sys.argv[1:]))
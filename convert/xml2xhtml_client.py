@@ -0,0 +1,68 @@
+#!/usr/bin/python3 -S
+
+# thin client for xml2xhtml.py conversion server (`xml2xhtml.py --server`):
+#  * send command line arguments and working directory to server and print messages from conversion
+#  * when server is not running (or stdin / stdout or --profile-summary is used) run xml2xhtml.py with the same arguments
+# usage is the same as xml2xhtml.py, server socket is $XML2XHTML_SOCKET or default socket of xml2xhtml.py
+# (python is run with -S, because client don't need site-packages -- this make its startup faster)
+
+# script dependencies:
+#  - xml2xhtml.py and xml2xhtml_socket.py (from this repo, should be place in the same directory as this script)
+
+
+# Copyright (c) 2019 Robert Ryszard Paciorek <rrp@opcode.eu.org>
+# 
+# MIT License
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import sys, os, socket, json
+
+from xml2xhtml_socket import defaultSocketPath, isSafeDir, isOwnSocket
+
+def runLocal():
+	script = os.path.join(os.path.dirname(os.path.realpath(__file__)), "xml2xhtml.py")
+	os.execv(sys.executable, [sys.executable, script] + sys.argv[1:])
+
+socketPath = defaultSocketPath()
+
+if '-' in sys.argv[1:] or '--server' in sys.argv[1:] or '--profile-summary' in sys.argv[1:]:
+	runLocal()
+
+# don't send request to socket which could be created by other user
+if not isSafeDir(socketPath) or not isOwnSocket(socketPath):
+	runLocal()
+
+client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+try:
+	client.connect(socketPath)
+except OSError:
+	client.close()
+	runLocal()
+
+client.sendall(json.dumps({'args': sys.argv[1:], 'cwd': os.getcwd()}).encode())
+client.shutdown(socket.SHUT_WR)
+try:
+	response = json.load(client.makefile("rb"))
+except ValueError:
+	print("Connection to server " + socketPath + " lost", file=sys.stderr)
+	sys.exit(1)
+
+sys.stderr.write(response['output'])
+sys.exit(response['status'])
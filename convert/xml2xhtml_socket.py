@@ -0,0 +1,66 @@
+#!/usr/bin/python3
+
+# unix socket of xml2xhtml.py conversion server -- library used by xml2xhtml.py (server) and xml2xhtml_client.py
+# default socket is in private (mode 0700) directory of user, so other users can't create (or replace) it,
+# server and client also check owner of socket (and its directory) before removing or connecting to it
+# (this module must import only modules already loaded by python -S, so client startup is not slower)
+
+
+
+# Copyright (c) 2019 Robert Ryszard Paciorek <rrp@opcode.eu.org>
+# 
+# MIT License
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+
+import os, stat
+
+# default path of server socket: $XML2XHTML_SOCKET or xml2xhtml-UID/server.sock in $XDG_RUNTIME_DIR ($TMPDIR, /tmp)
+def defaultSocketPath():
+	return os.environ.get("XML2XHTML_SOCKET") or os.path.join(
+		os.environ.get("XDG_RUNTIME_DIR") or os.environ.get("TMPDIR") or "/tmp", "xml2xhtml-%d" % os.getuid(), "server.sock"
+	)
+
+# return True when directory of socketPath is safe for socket -- owned by user (or root) and not writable by others
+# (or with sticky bit set, as /tmp), so socket can't be removed or replaced by other user
+def isSafeDir(socketPath):
+	try:
+		st = os.lstat(os.path.dirname(os.path.abspath(socketPath)))
+	except OSError:
+		return False
+	return stat.S_ISDIR(st.st_mode) and st.st_uid in (os.getuid(), 0) and (
+		not st.st_mode & (stat.S_IWGRP | stat.S_IWOTH) or bool(st.st_mode & stat.S_ISVTX)
+	)
+
+# return True when socketPath is socket (not symlink) owned by user
+def isOwnSocket(socketPath):
+	try:
+		st = os.lstat(socketPath)
+	except OSError:
+		return False
+	return stat.S_ISSOCK(st.st_mode) and st.st_uid == os.getuid()
+
+# (server) create directory for socket (with mode 0700, when not exists), return error message or None when socketPath can be used
+def prepareSocket(socketPath):
+	try:
+		os.makedirs(os.path.dirname(os.path.abspath(socketPath)), mode=0o700, exist_ok=True)
+	except OSError as e:
+		return "Can't create socket directory: " + str(e)
+	if not isSafeDir(socketPath):
+		return "Directory of socket " + socketPath + " is not owned by user or is writable by other users"
+	if os.path.lexists(socketPath) and not isOwnSocket(socketPath):
+		return "File " + socketPath + " exists and is not socket owned by user"
+	return None
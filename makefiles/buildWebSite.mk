@@ -45,6 +45,12 @@ SVGICONS   := gitRepo.svg htmlFile.svg pdfFile.svg webSite.svg
 IMGSRC     := images-src
 EXTRAPDF   := teacher
 
+# xml2xhtml_client.py convert XML in xml2xhtml.py server (without interpreter startup and modules import for each page)
+# started by `make xhtmlServer`, when server is not running it run xml2xhtml.py directly
+# (profile of all pages can be collected by `make XML2XHTML="xml2xhtml_client.py --profile $$PWD/profile.jsonl"`
+#  and summarized by `xml2xhtml.py --profile-summary profile.jsonl`)
+XML2XHTML  := xml2xhtml_client.py
+
 # add converting scripts from TextUtils to PATH
 TEXTUTILS  := $(abspath $(dir $(lastword $(MAKEFILE_LIST)))/..)
 export PATH := $(TEXTUTILS)/convert:$(PATH)
@@ -168,11 +174,32 @@ TeXBuildDir: $(TEXBUILDDIR)/pdfBooklets.cls $(TEXBUILDDIR)/LaTeX-demos-examples.
 .DELETE_ON_ERROR:
 
 # build XHTML from XML
+# xml2xhtml.py --depfile write $@.d with dependencies on included (by <insertSourceCode>) files,
+# --toc-json write $@.toc.json with table of content (used by xhtml2pdf.sh instead of parsing XHTML again)
 $(OUTDIR)/%.xhtml: %.xml  $(patsubst %,OutDir,$(FORCE)) | OutDir
-	rm -f "$(basename $@).pdf" "$@"
-	xml2xhtml.py "$<" "$@"
+	rm -f "$(basename $@).pdf" "$@" "$@.toc.json"
+	$(XML2XHTML) --depfile --toc-json "$<" "$@"
 	chmod 444 "$@"
 
+# build all out-of-date XHTML files by single xml2xhtml.py call (without interpreter startup for each page),
+# $? is list of .xml files changed after previous batch build, so `make buildAllXHTML buildAll` rebuild site quickly
+.PHONY: buildAllXHTML
+buildAllXHTML: $(OUTDIR)/.xhtml-batch
+
+$(OUTDIR)/.xhtml-batch: $(wildcard *.xml) | OutDir
+	rm -f $(foreach f,$(basename $?),"$(OUTDIR)/$(f).pdf" "$(OUTDIR)/$(f).xhtml" "$(OUTDIR)/$(f).xhtml.toc.json")
+	$(if $?,$(XML2XHTML) --depfile --toc-json -j 0 $(foreach f,$(basename $?),"$(f).xml" "$(OUTDIR)/$(f).xhtml"))
+	$(if $?,chmod 444 $(foreach f,$(basename $?),"$(OUTDIR)/$(f).xhtml"))
+	touch "$@"
+
+-include $(wildcard $(OUTDIR)/*.xhtml.d)
+
+# start xml2xhtml.py conversion server in background (it exits after 60 seconds without requests),
+# e.g. `make xhtmlServer buildAll` -- pages are converted by server as soon as it is ready
+.PHONY: xhtmlServer
+xhtmlServer:
+	xml2xhtml.py --server --idle-timeout 60 </dev/null >/dev/null 2>&1 &
+
 # build PDF from XHTML
 $(OUTDIR)/%.pdf: $(OUTDIR)/%.xhtml $(patsubst %,OutDir,$(FORCE)) | OutDir
 	rm -f "$@"